@@ -0,0 +1,235 @@
+"""
+Portfolio ingest-to-broadcast pipeline benchmark
+
+Drives MarketData.update -> Portfolio.update -> Portfolio._process -> History.tick -> PortfolioDashboard.broadcast
+with synthetic portfolios, random walk price updates and mock WebSocket clients, and reports throughput,
+ingest-to-send latency, allocations and peak traced memory per tick and serialized bytes per event.
+
+    python benchmark.py
+    python benchmark.py --positions 10 1000 50000 --rate 2000 --duration 10 --clients 20
+"""
+
+from argparse import ArgumentParser, Namespace
+import asyncio
+import json
+from logging import WARNING, basicConfig
+import os
+from random import choice, random, seed, uniform
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+import tracemalloc
+from typing import Any, Dict, List, Tuple
+
+from aiohttp import WSMsgType
+
+from stonks import config
+from stonks.app import Stonks
+from stonks.clients import Client
+
+CURRENCIES = ("NOK", "NOK", "EUR", "USD", "SEK")
+ASSETS = ("EQUITY", "FUND", "INDEX_FUND", "ETF", "INDEX_ETF")
+
+
+class MockWebSocket:
+    """Stands in for aiohttp's WebSocketResponse, records what would have been sent to the client"""
+
+    def __init__(self, latency: Dict[str, float] = None):
+        self.closed = False
+        self.frames: Dict[str, List[int]] = {}
+        self.latencies: List[float] = []
+        self._ingested = latency
+
+    async def send_str(self, data: str):
+        self._record(data, len(data.encode()))
+
+    async def send_bytes(self, data: bytes):
+        self._record(data, len(data))
+
+    async def send_frame(self, data: bytes, opcode: WSMsgType):
+        self._record(data.decode() if opcode == WSMsgType.TEXT else data, len(data))
+
+    async def close(self):
+        self.closed = True
+
+    def _record(self, data, size: int):
+        event_type = "binary"
+        if isinstance(data, str):
+            event = json.loads(data)
+            event_type = event["type"]
+            # Only the latency probe tracks the time from ingest until the ticker event is sent
+            if self._ingested is not None and event_type == "ticker":
+                t = self._ingested.pop(event["data"]["ticker"], None)
+                if t is not None:
+                    self.latencies.append(perf_counter() - t)
+        self.frames.setdefault(event_type, []).append(size)
+
+
+def synthetic_config(positions: int) -> str:
+    data = {"positions": []}
+    for i in range(positions):
+        volume = round(uniform(1, 1000))
+        price = round(uniform(10, 1000), 2)
+        data["positions"].append(
+            {
+                "name": f"Synthetic {i}",
+                "ticker": f"SYN{i}_OSE",
+                "volume": volume,
+                "price": price,
+                "cost": round(volume * price),
+                "currency": choice(CURRENCIES),
+                "asset": choice(ASSETS),
+            }
+        )
+
+    with NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(data, f)
+        return f.name
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def produce(stonks: Stonks, rate: float, duration: float, ingested: Dict[str, float]) -> int:
+    """Random walk price updates, like the simulator collector but at a fixed rate"""
+    portfolio = stonks.default.portfolio
+    tickers = list(portfolio.positions)
+    prices = {t: portfolio.positions[t].market_price for t in tickers}
+    sent = 0
+    start = perf_counter()
+    end = start + duration
+
+    while perf_counter() < end:
+        # Catch up with the target rate in slices, rate 0 means as fast as possible
+        due = int((perf_counter() - start) * rate) - sent if rate else 100
+        for _ in range(max(due, 0)):
+            t = choice(tickers)
+            prices[t] = round(prices[t] + (random() - 0.5) * prices[t] * 0.02, 2)
+            ingested.setdefault(t, perf_counter())
+            await stonks.market.update((t, prices[t]))
+            sent += 1
+        await asyncio.sleep(0.001)
+
+    return sent
+
+
+async def measure_memory(stonks: Stonks, ticks: int) -> Tuple[float, float]:
+    """
+    Average allocations per tick and peak of the memory traced while processing a tick, above what was allocated
+    before it. Allocations are the blocks a tick allocated that were still alive at its end, like the candles,
+    frames and position rows it stores, as counted by comparing tracemalloc snapshots per file.
+    """
+    portfolio = stonks.default.portfolio
+    tickers = list(portfolio.positions)
+    allocations = []
+    peaks = []
+
+    tracemalloc.start()
+    for _ in range(ticks):
+        t = choice(tickers)
+        price = round(portfolio.positions[t].market_price * uniform(0.99, 1.01), 2)
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        await portfolio._process([(t, price)])
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        after = tracemalloc.take_snapshot()
+        allocations.append(sum(max(s.count_diff, 0) for s in after.compare_to(before, "filename")))
+    tracemalloc.stop()
+
+    return sum(allocations) / len(allocations), sum(peaks) / len(peaks)
+
+
+async def bench(positions: int, rate: float, duration: float, clients: int) -> Dict[str, Any]:
+    config_file = synthetic_config(positions)
+    try:
+        stonks = Stonks(
+            Namespace(
+                config=[config_file],
+                db=None,
+                simulate=False,
+                workers=False,
+                role="standalone",
+                port=None,
+                socket=None,
+            )
+        )
+    finally:
+        # The portfolio is loaded by the constructor, the file isn't needed after
+        os.unlink(config_file)
+    dashboard = stonks.default
+    await stonks.db.initialize()
+    portfolio_task = asyncio.create_task(dashboard.portfolio.start())
+
+    ingested: Dict[str, float] = {}
+    sockets = [MockWebSocket(ingested if i == 0 else None) for i in range(clients)]
+    for i, ws in enumerate(sockets):
+        dashboard.attach(Client(ws, f"bench-{i}"))
+    # Keep strong references, the client registry is a WeakSet
+    registered = list(dashboard.clients)
+
+    started = perf_counter()
+    sent = await produce(stonks, rate, duration, ingested)
+    await asyncio.sleep(config.PROCESSING_MIN_INTERVAL * 2)
+    elapsed = perf_counter() - started
+
+    probe = sockets[0]
+    result = {
+        "positions": positions,
+        "offered": sent / duration,
+        "processed": len(probe.frames.get("ticker", [])) / elapsed,
+        "p50": percentile(probe.latencies, 50) * 1000,
+        "p99": percentile(probe.latencies, 99) * 1000,
+        "bytes": {k: sum(v) / len(v) for k, v in probe.frames.items()},
+    }
+
+    # Memory is measured without clients, so its ticks neither add to the frames above nor flood the client queues
+    for client in registered:
+        await dashboard.detach(client)
+    result["allocations"], result["peak_memory"] = await measure_memory(stonks, 200)
+
+    await dashboard.portfolio.stop()
+    await dashboard.bus.stop()
+    portfolio_task.cancel()
+    await stonks.db.stop()
+
+    return result
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the portfolio ingest-to-broadcast pipeline")
+    parser.add_argument("--positions", type=int, nargs="+", default=[10, 1000, 50000], help="portfolio sizes")
+    parser.add_argument("--rate", type=float, default=1000, help="ticker updates per second, 0 for unbounded")
+    parser.add_argument("--duration", type=float, default=5, help="seconds to run each portfolio size")
+    parser.add_argument("--clients", type=int, default=10, help="number of mock WebSocket clients")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    args = parser.parse_args()
+
+    basicConfig(level=WARNING, format=config.LOG_FORMAT, datefmt=config.LOG_DATEFORMAT)
+    seed(args.seed)
+
+    print(f"rate={args.rate or 'unbounded'}/s duration={args.duration}s clients={args.clients}")
+    print(
+        f"{'positions':>10} {'offered/s':>10} {'ticks/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'allocs/tick':>12} {'peak B/tick':>13}"
+    )
+    results = []
+    for n in args.positions:
+        r = asyncio.run(bench(n, args.rate, args.duration, args.clients))
+        results.append(r)
+        print(
+            f"{r['positions']:>10} {r['offered']:>10.0f} {r['processed']:>10.0f} "
+            f"{r['p50']:>8.2f} {r['p99']:>8.2f} {r['allocations']:>12.1f} {r['peak_memory']:>13.0f}"
+        )
+
+    print("\nserialized bytes per event")
+    for r in results:
+        sizes = " ".join(f"{k}={v:.0f}" for k, v in sorted(r["bytes"].items()))
+        print(f"{r['positions']:>10} {sizes}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,30 @@ from logging import DEBUG, INFO, basicConfig, getLogger
 
 from stonks import __version__, config
 from stonks.app import Stonks
+from stonks.fanout import FanOut
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
-    parser.add_argument("-c", "--config", help="use a JSON config file to load positions")
+    parser.add_argument(
+        "-c",
+        "--config",
+        action="append",
+        help="use a JSON config file to load positions, repeat to serve several portfolios from one process",
+    )
     parser.add_argument("--db", help="path to SQLite databse file")
     parser.add_argument("-d", "--debug", action="store_true", help="enable debug output")
     parser.add_argument("-s", "--simulate", action="store_true", help="activate the simulation engine")
+    parser.add_argument("-w", "--workers", action="store_true", help="run each collector in a worker process")
+    parser.add_argument("-p", "--port", type=int, default=config.PORT, help="port to serve the dashboard on")
+    parser.add_argument(
+        "--role",
+        choices=("standalone", "primary", "fanout"),
+        default="standalone",
+        help="run everything in one process, or split in a primary with the portfolio and fan-outs serving clients",
+    )
+    parser.add_argument("--socket", default=config.FANOUT_SOCKET, help="unix socket between primary and fan-outs")
+    parser.add_argument("--portfolio", help="portfolio of the primary a fan-out serves, by config file name")
     parser.add_argument("-v", "--version", action="version", version=f"Stonks v{__version__}")
     args = parser.parse_args()
 
@@ -18,5 +34,5 @@ if __name__ == "__main__":
     basicConfig(level=log_level, format=config.LOG_FORMAT, datefmt=config.LOG_DATEFORMAT)
     getLogger("aiosqlite").setLevel(INFO)
 
-    s = Stonks(args)
+    s = FanOut(args) if args.role == "fanout" else Stonks(args)
     s.run()
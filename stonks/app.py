@@ -2,109 +2,322 @@
 
 from argparse import Namespace
 import asyncio
+from datetime import datetime
 from logging import getLogger
-from os.path import join
-from weakref import WeakSet
+from pathlib import Path
+import signal
+from typing import Any, Dict, Iterable, Optional, Set
 
 from aiohttp import WSMsgType, web
 
 from . import __version__
 from . import config as c
+from . import protocol
+from .clients import Client, Frame
+from .collectors.base import close_session
 from .collectors.euronext import EuronextForex
 from .collectors.finansavisen import Finansavisen
 from .collectors.nordnet import NordNetFunds
 from .collectors.simulator import Simulator
 from .collectors.yahoo import YahooFinance
 from .db import Database
-from .events import Event, EventType
+from .events import Dispatch, Event, EventType
+from .fanout import EVENT, RESPONSE, SNAPSHOT, Relay, encode_message
+from .marketdata import MarketData
 from .portfolio import Portfolio
-from .serialize import serialize
+from .serialize import TextFrame, deserialize, serialize_frame
+from .server import Dashboard, dashboard_app
+from .snapshots import Snapshot
+from .worker import WorkerTask
 
 LOG = getLogger(__name__)
 
 
+class PortfolioDashboard(Dashboard):
+    """Dashboard of a portfolio in this process, its events are broadcast to clients and fan-out processes"""
+
+    # Bus topics broadcast to the dashboard
+    TOPICS = ("portfolio.#", "ticker.#", "index.#", "chart.tick", "chart.history", "status")
+
+    def __init__(self, app: web.Application, portfolio: Portfolio, paths: Iterable[str] = ("",), primary=False):
+        super().__init__(app, paths)
+        self.portfolio = portfolio
+        self.bus = portfolio.bus
+
+        # Shared by every connecting client, only re-serialized when the portfolio or its history changes
+        history = portfolio.history
+        self.snapshots = {
+            EventType.PORTFOLIO: Snapshot(EventType.PORTFOLIO, lambda: portfolio, lambda: portfolio.version),
+            EventType.CHART: Snapshot(EventType.CHART, history.json, lambda: history.version),
+        }
+
+        # As the primary, dashboard clients are served by fan-out processes connecting to a local socket
+        self.relays: Set[Relay] = set()
+        self.listening = False
+        if primary:
+            self.app.add_routes([web.get(f"/upstream{path}", self.get_upstream) for path in paths])
+
+    async def get_upstream(self, request):
+        """Event stream for a fan-out process, every event is sent in both protocols for it to pass on as is"""
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        relay = Relay(ws, request.remote)
+        self.listen()
+        self.relays.add(relay)
+        relay.start()
+
+        LOG.info("[Relay] Fan-out connected %s (connected: %d)", relay.remote, len(self.relays))
+        try:
+            for event_type, snapshot in self.snapshots.items():
+                frame = snapshot.frame()
+                relay.send(encode_message(SNAPSHOT, event_type, frame, ref=snapshot.version, seq=self.seq(event_type)))
+
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    try:
+                        forwarded = deserialize(msg.data)
+                        frame = self.chart_frame(relay.remote, forwarded["request"])
+                        relay.send(encode_message(RESPONSE, EventType.CHART_SERIES, frame or b"", ref=forwarded["id"]))
+                    except (KeyError, TypeError, ValueError) as e:
+                        LOG.warning("[Relay] Ignoring malformed request from fan-out %s: %s", relay.remote, e)
+                elif msg.type == WSMsgType.ERROR:
+                    LOG.error("[Relay] Closed with unexpected error")
+                    LOG.exception(ws.exception())
+        finally:
+            # Also when the handler is cancelled or fails, so the relay never keeps the topics subscribed
+            self.relays.discard(relay)
+            await relay.stop()
+            await self.unlisten()
+            LOG.info("[Relay] Fan-out closed %s (connected: %d)", relay.remote, len(self.relays))
+
+        return ws
+
+    def attach(self, client: Client):
+        self.listen()
+        super().attach(client)
+
+    async def detach(self, client: Client):
+        await super().detach(client)
+        await self.unlisten()
+
+    def listen(self):
+        """
+        Topics are only subscribed while clients or fan-outs are connected, so without any there are no event
+        payloads built at all. Broadcasting is queued, so encoding frames never holds up portfolio processing, and
+        events keep their order.
+        """
+        if not self.listening:
+            self._subscribe()
+            self.listening = True
+
+    async def unlisten(self):
+        if self.listening and not self.clients and not self.relays:
+            # Cleared before awaiting, so a client attaching while the observer stops subscribes again
+            self.listening = False
+            for topic in self.TOPICS:
+                await self.bus.unsubscribe(topic, self.broadcast)
+            if self.clients or self.relays:
+                # Attached in between, and the remaining unsubscribes may have undone part of its subscriptions
+                self._subscribe()
+                self.listening = True
+
+    def _subscribe(self):
+        for topic in self.TOPICS:
+            self.bus.subscribe(topic, self.broadcast, dispatch=Dispatch.QUEUE, task=self.portfolio)
+
+    def send_chart(self, client: Client, request: dict):
+        frame = self.chart_frame(client.remote, request)
+        if frame is not None:
+            client.send(frame)
+
+    @staticmethod
+    def timestamp(value: Any) -> Optional[datetime]:
+        if value is None:
+            return None
+        timestamp = int(value)
+        if not 0 <= timestamp <= c.CHART_MAX_TIMESTAMP:
+            raise ValueError(f"timestamp {timestamp} is out of range")
+        return datetime.fromtimestamp(timestamp, c.TZ)
+
+    def chart_frame(self, remote: Optional[str], request: dict) -> Optional[TextFrame]:
+        try:
+            resolution = c.Resolution(request.get("resolution", c.Resolution.HOUR.value))
+            start, end = (self.timestamp(request.get(k)) for k in ("start", "end"))
+            if start is not None and end is not None and start > end:
+                raise ValueError(f"start {start} is after end {end}")
+            points = int(request.get("points", c.CHART_MAX_POINTS))
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            LOG.warning("[WS] Invalid chart request from %s: %s", remote, e)
+            return None
+
+        candles = self.portfolio.history.query(resolution, start, end, points)
+        data = {"resolution": resolution.value, "candles": candles}
+        return serialize_frame(Event(EventType.CHART_SERIES, data).json())
+
+    async def broadcast(self, e: Event):
+        if self.clients:
+            self.fan_out(e.type, lambda binary: self.encode(e, binary), e.topic)
+
+        if self.relays:
+            message = self.relay_message(e)
+            for relay in self.relays:
+                relay.send(message)
+
+    def encode(self, e: Event, binary: bool = False) -> Frame:
+        frame = protocol.encode(e, self.portfolio.ids) if binary else None
+        return frame if frame is not None else serialize_frame(e.json())
+
+    def relay_message(self, e: Event) -> bytes:
+        # Snapshot events are relayed from the shared snapshot, so fan-outs can cache it under the same version
+        snapshot = self.snapshots.get(e.type)
+        if snapshot is not None:
+            frame = snapshot.frame()
+            return encode_message(EVENT, e.type, frame, ref=snapshot.version, seq=self.seq(e.type))
+
+        # Deltas carry their sequence number, so fan-outs can tell which of them a snapshot already covers
+        seq = e.data["seq"] if e.type == EventType.PORTFOLIO_DELTA else 0
+        binary = protocol.encode(e, self.portfolio.ids)
+        return encode_message(EVENT, e.type, serialize_frame(e.json()), binary, seq=seq, topic=e.topic)
+
+    def seq(self, event_type: EventType) -> int:
+        """
+        Sequence number of the latest delta a snapshot includes. Only valid right after building its frame, the
+        sequence number changes with every delta and every delta bumps the version.
+        """
+        return self.portfolio.sequence if event_type == EventType.PORTFOLIO else 0
+
+    async def push_snapshots(self):
+        """Refresh the snapshots cached by fan-outs, so the deltas they keep for new clients stay few"""
+        pushed: Dict[EventType, Optional[int]] = {}
+
+        while True:
+            await asyncio.sleep(c.FANOUT_SNAPSHOT_INTERVAL)
+            if not self.relays:
+                continue
+
+            for event_type, snapshot in self.snapshots.items():
+                frame = snapshot.frame()
+                if pushed.get(event_type) != snapshot.version:
+                    message = encode_message(
+                        SNAPSHOT, event_type, frame, ref=snapshot.version, seq=self.seq(event_type)
+                    )
+                    for relay in self.relays:
+                        relay.send(message)
+                    pushed[event_type] = snapshot.version
+
+    async def stop(self):
+        await self.bus.stop()
+        await self.close_clients()
+        for relay in list(self.relays):
+            await relay.stop()
+
+
 class Stonks:
+    """
+    Runs the portfolios given on the command line against shared market data, every instrument is collected once
+    however many portfolios hold it. The first portfolio is the default one, served at /ws and kept in the history
+    table. Every portfolio is also served at /ws/<name>, named after its config file, and has a history_<name>
+    table unless it is the default.
+    """
+
     def __init__(self, args: Namespace):
-        self.app = web.Application()
+        self.app = dashboard_app()
         self.db = Database(f"sqlite+aiosqlite:///{args.db}" if args.db else "sqlite+aiosqlite://")
-        self.portfolio = Portfolio.from_config(args.config, self.db) if args.config else Portfolio(self.db, [])
-        self.collectors = [
-            self.portfolio,
-            NordNetFunds(self.portfolio),
-            EuronextForex(self.portfolio),
-            YahooFinance(self.portfolio),
-            Finansavisen(self.portfolio),
-        ]
-        self._tasks = []
+        self.primary = args.role == "primary"
+        self.port: Optional[int] = args.port
+        self.socket: Optional[str] = args.socket
 
-        self.app["clients"] = WeakSet()
-        self.app.add_routes([web.get("/", self.get_index), web.get("/ws", self.get_ws)])
-        self.app.router.add_static("/static/", path=join(c.PUB_ROOT, "static"), name="static")
-        self.app.on_startup.append(self.on_startup)
-        self.app.on_shutdown.append(self.on_shutdown)
-
-        # Subscribe to portfolio events that should be broadcast to the dashboard
-        for et in (EventType.TICKER, EventType.PORTFOLIO, EventType.INDEX, EventType.CHART, EventType.CHART_TICK):
-            self.portfolio.on(et, self.broadcast)
+        self.dashboards: Dict[str, PortfolioDashboard] = {}
+        self.config_files: Dict[str, str] = {}
+        for config_file in args.config or [None]:
+            self.add_portfolio(config_file)
+        self.default = next(iter(self.dashboards.values()))
+        portfolios = [d.portfolio for d in self.dashboards.values()]
+        self.market = MarketData(self.db, portfolios)
 
+        collectors = [NordNetFunds, EuronextForex, YahooFinance, Finansavisen]
         if args.simulate:
             LOG.warning("Simulator active!")
-            self.collectors.append(Simulator(self.portfolio))
+            collectors.append(Simulator)
+        if args.workers:
+            LOG.info("Running %d collectors in worker processes", len(collectors))
+            self.collectors = [*portfolios, *(WorkerTask(self.market, cls.__name__) for cls in collectors)]
+        else:
+            self.collectors = [*portfolios, *(cls(self.market) for cls in collectors)]
+        self._tasks = []
+        self._reload: Optional[asyncio.Task] = None
 
-    def run(self):
-        LOG.info("Starting Stonks %s", __version__)
-        web.run_app(self.app)
+        self.app.on_startup.append(self.on_startup)
+        self.app.on_shutdown.append(self.on_shutdown)
 
-    async def get_index(self, request):
-        return web.FileResponse(join(c.PUB_ROOT, "index.html"))
+    def add_portfolio(self, config_file: Optional[str]):
+        name = Path(config_file).stem if config_file else "default"
+        if name in self.dashboards:
+            raise ValueError(f"Portfolio {name} is configured twice, config file names must be unique")
 
-    async def get_ws(self, request):
-        ws = web.WebSocketResponse()
-        await ws.prepare(request)
-        clients = self.app["clients"]
-        clients.add(ws)
-
-        LOG.info("[WS] Client connected %s (connected: %d)", request.remote, len(clients))
-        await ws.send_json(Event(EventType.PORTFOLIO, self.portfolio).json(), dumps=serialize)
-        await ws.send_json(Event(EventType.CHART, self.portfolio.history.json()).json(), dumps=serialize)
-
-        async for msg in ws:
-            LOG.debug("[WS] Received msg: %s", msg)
-
-            if msg.type == WSMsgType.TEXT:
-                if msg.data == "close":
-                    await ws.close()
-                    LOG.info("[WS] Closed %s", ws)
-            elif msg.type == WSMsgType.ERROR:
-                LOG.error("[WS] Closed with unexpected error")
-                LOG.exception(ws.exception())
-            elif msg.type in (WSMsgType.CLOSING, WSMsgType.CLOSED):
-                await ws.close()
-                LOG.info("[WS] Closed %s", ws)
-
-        clients.remove(ws)
-        LOG.info("[WS] Closed %s (connected: %d)", request.remote, len(clients))
+        # Shared market data records the ticks, once per instrument
+        if self.dashboards:
+            paths, kwargs = (f"/{name}",), {"name": f"Portfolio {name}", "history_table": f"history_{name}"}
+        else:
+            paths, kwargs = ("", f"/{name}"), {}
+        if config_file:
+            portfolio = Portfolio.from_config(config_file, self.db, ticks=False, **kwargs)
+        else:
+            portfolio = Portfolio(self.db, [], ticks=False, **kwargs)
 
-        return ws
+        self.dashboards[name] = PortfolioDashboard(self.app, portfolio, paths, self.primary)
+        if config_file:
+            self.config_files[name] = config_file
+        LOG.info("Serving %s at %s", portfolio.name, ", ".join(f"/ws{path}" for path in paths))
 
-    async def broadcast(self, e: Event):
-        for client in self.app["clients"]:
-            try:
-                await client.send_json(e.json(), dumps=serialize)
-            except Exception as e:
-                LOG.error("[WS] Failed to broadcast to client: %s", e)
+    def run(self):
+        LOG.info("Starting Stonks %s", __version__)
+        if self.primary:
+            LOG.info("Serving fan-out processes on %s", self.socket)
+            web.run_app(self.app, path=self.socket)
+        else:
+            web.run_app(self.app, port=self.port)
 
     async def on_startup(self, app):
         await self.db.initialize()
         LOG.debug("Spawning tasks for %d collectors", len(self.collectors))
         self._tasks.extend(asyncio.create_task(c.start(), name=c.name) for c in self.collectors)
         self._tasks.append(asyncio.create_task(self.push_status(), name="status"))
+        if self.primary:
+            for name, dashboard in self.dashboards.items():
+                self._tasks.append(asyncio.create_task(dashboard.push_snapshots(), name=f"snapshots-{name}"))
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self.on_sighup)
+
+    def on_sighup(self):
+        if self._reload is None or self._reload.done():
+            self._reload = asyncio.create_task(self.reload(), name="reload")
+
+    async def reload(self):
+        """Reload the config files, positions added or removed are picked up by the collectors owning them"""
+        for name, config_file in self.config_files.items():
+            LOG.info("Reloading %s", config_file)
+            try:
+                positions = Portfolio.load_config(config_file)
+            except (OSError, ValueError, KeyError) as e:
+                LOG.error("Failed to reload %s, keeping the current positions: %s", config_file, e)
+                continue
+            try:
+                await self.dashboards[name].portfolio.reload(positions)
+            except Exception as e:
+                LOG.error("Failed to apply %s: %s", config_file, e)
+                LOG.exception(e)
 
     async def on_shutdown(self, app):
         LOG.info("Stopping Stonks")
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        if self._reload:
+            await self._reload
 
         for c in self.collectors:
             await c.stop()
+        for dashboard in self.dashboards.values():
+            await dashboard.stop()
+        await close_session()
         await self.db.stop()
         for t in self._tasks:
             LOG.debug("Cancelling task %s ...", t.get_name())
@@ -119,5 +332,7 @@ class Stonks:
     async def push_status(self):
         while True:
             await asyncio.sleep(1)
-            e = Event(EventType.STATUS, {c.name: c.stats.json() for c in self.collectors})
-            await self.broadcast(e)
+            for dashboard in self.dashboards.values():
+                await dashboard.bus.publish(
+                    "status", EventType.STATUS, lambda: {c.name: c.stats.json() for c in self.collectors}
+                )
@@ -0,0 +1,111 @@
+"""Event bus"""
+
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from . import config as c
+from .events import Backpressure, Dispatch, Event, EventType, Observer
+
+if TYPE_CHECKING:
+    from .task import Task
+
+LOG = getLogger(__name__)
+
+Payload = Union[Any, Callable[[], Any]]
+
+
+def matches(pattern: str, topic: str) -> bool:
+    """Match a dot separated topic, * matches exactly one level and a trailing # any number of levels"""
+    levels = topic.split(".")
+    parts = pattern.split(".")
+
+    for i, part in enumerate(parts):
+        if part == "#":
+            return i == len(parts) - 1
+        if i >= len(levels) or (part != "*" and part != levels[i]):
+            return False
+
+    return len(parts) == len(levels)
+
+
+class EventBus:
+    """
+    Publish/subscribe with hierarchical topics, e.g. ticker.MOWI_OSE, chart.tick or portfolio.delta. Payloads may
+    be given as factories, which are only called when someone subscribes to the topic. Matching subscribers are
+    cached per topic, so publishing to a topic nobody listens to costs a dict lookup.
+    """
+
+    def __init__(self) -> None:
+        self.errors = 0
+        self._subscriptions: Dict[str, Dict[Coroutine, Observer]] = {}
+        self._matches: Dict[str, List[Observer]] = {}
+
+    def subscribe(
+        self,
+        pattern: str,
+        cb: Coroutine,
+        dispatch: Dispatch = Dispatch.SEQUENTIAL,
+        backpressure: Backpressure = Backpressure.BLOCK,
+        maxsize: int = c.EVENT_QUEUE_SIZE,
+        task: Optional["Task"] = None,
+    ):
+        """
+        Subscribe to topics matching a pattern, a callback subscribed with the same options shares one queue. Errors
+        raised by the callback are counted in the stats of the given task.
+        """
+        options = (dispatch, backpressure, maxsize)
+        shared = (o for subscribers in self._subscriptions.values() for o in subscribers.values() if o.cb == cb)
+        observer = next((o for o in shared if o.options == options and o.task is task), None)
+        # An observer with nothing queued has a length of 0, so test for None rather than truthiness
+        if observer is None:
+            observer = Observer(self, cb, *options, task=task)
+
+        self._subscriptions.setdefault(pattern, {})[cb] = observer
+        self._matches.clear()
+
+    async def unsubscribe(self, pattern: str, cb: Coroutine):
+        """Unsubscribe from a pattern, the observer is stopped once it isn't subscribed to anything else"""
+        observer = self._subscriptions.get(pattern, {}).pop(cb, None)
+        if pattern in self._subscriptions and not self._subscriptions[pattern]:
+            del self._subscriptions[pattern]
+        self._matches.clear()
+
+        if observer is not None and not any(o is observer for s in self._subscriptions.values() for o in s.values()):
+            await observer.stop()
+
+    def subscribers(self, topic: str) -> List[Observer]:
+        if topic not in self._matches:
+            found = {}
+            for pattern, subscribers in self._subscriptions.items():
+                if matches(pattern, topic):
+                    # An observer subscribed through several matching patterns still gets the event once
+                    found.update((id(o), o) for o in subscribers.values())
+            self._matches[topic] = list(found.values())
+
+        return self._matches[topic]
+
+    async def publish(self, topic: str, event_type: EventType, payload: Payload = None) -> bool:
+        """Publish an event, a callable payload is only materialized if the topic has subscribers"""
+        subscribers = self.subscribers(topic)
+        if not subscribers:
+            return False
+
+        data = payload() if callable(payload) else payload
+        event = Event(event_type, data, topic)
+        for observer in subscribers:
+            await observer.deliver(event)
+
+        return True
+
+    def observer_error(self, event: Event, cb: Coroutine, e: Exception):
+        self.errors += 1
+        LOG.error("[Bus] Subscriber %s failed to handle %s: %s", getattr(cb, "__qualname__", cb), event.topic, e)
+        LOG.exception(e)
+
+    async def stop(self):
+        observers = {id(o): o for subscribers in self._subscriptions.values() for o in subscribers.values()}
+        for observer in observers.values():
+            await observer.stop()
+
+    def __repr__(self) -> str:
+        return f"EventBus<{', '.join(self._subscriptions)}>"
@@ -0,0 +1,222 @@
+"""Dashboard WebSocket clients"""
+
+import asyncio
+import math
+from collections import deque
+from logging import getLogger
+from time import monotonic
+from typing import Awaitable, Deque, Dict, FrozenSet, Mapping, Optional, Tuple, Union
+
+from aiohttp import WSMsgType, web
+
+from . import config as c
+from .events import EventType
+from .serialize import TextFrame
+
+LOG = getLogger(__name__)
+
+# JSON frames are TextFrames, or str, anything else in bytes is a binary protocol frame
+Frame = Union[str, bytes]
+
+
+class ClientOptions:
+    """
+    Per-connection options negotiated through the query string, e.g.
+    /ws?protocol=binary&exclude=ticker&rate=status:0.2,chart_tick:1&compress=0
+    """
+
+    # Deltas depend on every previous one, they are never filtered or coalesced
+    REQUIRED = frozenset({EventType.PORTFOLIO_DELTA})
+
+    def __init__(
+        self,
+        binary: bool = False,
+        compress: bool = c.WS_COMPRESS,
+        events: Optional[FrozenSet[EventType]] = None,
+        exclude: FrozenSet[EventType] = frozenset(),
+        rates: Optional[Dict[EventType, float]] = None,
+    ) -> None:
+        self.binary = binary
+        self.compress = compress
+        self.events = events
+        self.exclude = exclude - self.REQUIRED
+        # Min seconds between two events of the same type and topic, anything in between is coalesced to the latest
+        self.intervals = {e: 1 / r for e, r in (rates or {}).items() if e not in self.REQUIRED}
+
+    @classmethod
+    def from_query(cls, query: Mapping[str, str]) -> "ClientOptions":
+        """Parse options from the connection query string, raises ValueError on unknown event types or rates"""
+
+        def event_types(value: str) -> FrozenSet[EventType]:
+            return frozenset(EventType(v) for v in value.split(",") if v)
+
+        rates = {}
+        for rate in query.get("rate", "").split(","):
+            if rate:
+                event, per_second = rate.split(":")
+                rates[EventType(event)] = float(per_second)
+                if not math.isfinite(rates[EventType(event)]) or rates[EventType(event)] <= 0:
+                    raise ValueError(f"Rate for {event} must be a positive number")
+
+        return cls(
+            binary=query.get("protocol") == "binary",
+            compress=query.get("compress", "1" if c.WS_COMPRESS else "0") not in ("0", "false"),
+            events=event_types(query["events"]) | cls.REQUIRED if "events" in query else None,
+            exclude=event_types(query.get("exclude", "")),
+            rates=rates,
+        )
+
+    def wants(self, event: EventType) -> bool:
+        return (self.events is None or event in self.events) and event not in self.exclude
+
+    def __repr__(self) -> str:
+        events = "all" if self.events is None else ",".join(e.value for e in self.events)
+        return f"ClientOptions(binary={self.binary}, compress={self.compress}, events={events})"
+
+
+class Client:
+    """
+    Dashboard client with a bounded send queue. Frames are encoded once by the broadcaster and queued
+    for every client, a dedicated sender task per client drains the queue so a slow socket never blocks
+    the producer. When the queue is full the oldest event frames are dropped, and a client that cannot complete
+    a single send within the configured timeout is disconnected.
+    """
+
+    # Snapshots and replies are never dropped, without them the dashboard can't apply anything that follows.
+    # Dropped deltas leave a gap in the sequence, which the dashboard recovers from with a resync.
+    KEEP = frozenset({EventType.PORTFOLIO, EventType.CHART})
+
+    def __init__(
+        self, ws: web.WebSocketResponse, remote: Optional[str] = None, options: Optional[ClientOptions] = None
+    ) -> None:
+        self.ws = ws
+        self.remote = remote
+        self.options = options or ClientOptions()
+        # Negotiated at connect, binary clients get compact frames for the events that have one
+        self.binary = self.options.binary
+        self.dropped = 0
+        # Frames with the event they were broadcast for, None for snapshots and replies sent to this client only
+        self._queue: Deque[Tuple[Frame, Optional[EventType]]] = deque()
+        self._ready = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+        self._running = False
+        self._closing = False
+        # Rate limited event types and topics, when they were last queued and the latest frame held back since
+        self._sent_at: Dict[Tuple[EventType, Optional[str]], float] = {}
+        self._coalesced: Dict[Tuple[EventType, Optional[str]], Frame] = {}
+        self._timers: Dict[Tuple[EventType, Optional[str]], asyncio.TimerHandle] = {}
+
+    @property
+    def closed(self) -> bool:
+        return self._closing or self.ws.closed
+
+    def start(self):
+        self._running = True
+        self._sender = asyncio.create_task(self._send_loop(), name=f"ws-{self.remote}")
+
+    async def stop(self):
+        self._running = False
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if self._sender:
+            # wait_for() may swallow the cancellation if a send completes at the same time, the flag and
+            # wakeup make sure the loop exits anyway
+            self._ready.set()
+            self._sender.cancel()
+            try:
+                await self._sender
+            except asyncio.CancelledError:
+                pass
+            self._sender = None
+
+    def send(self, frame: Frame, event: Optional[EventType] = None, topic: Optional[str] = None) -> bool:
+        """
+        Queue a frame, broadcast events are filtered and rate limited according to the client options. Rate limited
+        frames are coalesced per topic, so every instrument keeps its own latest frame.
+        """
+        if self.closed:
+            return False
+
+        if event is not None:
+            if not self.options.wants(event):
+                return False
+
+            interval = self.options.intervals.get(event)
+            if interval:
+                key = (event, topic)
+                elapsed = monotonic() - self._sent_at.get(key, 0.0)
+                if elapsed < interval:
+                    if key not in self._timers:
+                        loop = asyncio.get_running_loop()
+                        self._timers[key] = loop.call_later(interval - elapsed, self._release, key)
+                    self._coalesced[key] = frame
+                    return True
+                self._sent_at[key] = monotonic()
+
+        self._enqueue(frame, event)
+        return True
+
+    def _release(self, key: Tuple[EventType, Optional[str]]):
+        self._timers.pop(key, None)
+        frame = self._coalesced.pop(key, None)
+        if frame is not None and self._running and not self.closed:
+            self._sent_at[key] = monotonic()
+            self._enqueue(frame, key[0])
+
+    def _enqueue(self, frame: Frame, event: Optional[EventType] = None):
+        if len(self._queue) >= c.CLIENT_SEND_QUEUE_SIZE and not self._drop_oldest():
+            LOG.warning("[WS] Client %s has %d snapshots queued, disconnecting", self.remote, len(self._queue))
+            self._closing = True
+            asyncio.create_task(self.ws.close())
+            return
+
+        self._queue.append((frame, event))
+        self._ready.set()
+
+    def _drop_oldest(self) -> bool:
+        """Drop the oldest frame that may be dropped, False if all of the queued frames have to be sent"""
+        for i, (_, event) in enumerate(self._queue):
+            if event is not None and event not in self.KEEP:
+                del self._queue[i]
+                self.dropped += 1
+                if self.dropped % c.CLIENT_SEND_QUEUE_SIZE == 1:
+                    LOG.warning("[WS] Client %s is lagging behind, dropped %d frames", self.remote, self.dropped)
+                return True
+
+        return False
+
+    async def _send_loop(self):
+        try:
+            while self._running and not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+
+                while self._queue and self._running and not self.closed:
+                    frame, _ = self._queue.popleft()
+                    await asyncio.wait_for(self._send(frame), c.CLIENT_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            LOG.warning("[WS] Client %s stalled for %ss, disconnecting", self.remote, c.CLIENT_SEND_TIMEOUT)
+            await self.ws.close()
+        except ConnectionResetError as e:
+            LOG.info("[WS] Client %s went away: %s", self.remote, e)
+        except Exception as e:
+            LOG.error("[WS] Failed to send to client %s: %s", self.remote, e)
+            await self.ws.close()
+
+    def _send(self, frame: Frame) -> Awaitable[None]:
+        if isinstance(frame, TextFrame):
+            # aiohttp 3.11 and later send encoded text as is, older versions take a str only
+            if hasattr(self.ws, "send_frame"):
+                return self.ws.send_frame(frame, WSMsgType.TEXT)
+            return self.ws.send_str(frame.decode())
+        if isinstance(frame, bytes):
+            return self.ws.send_bytes(frame)
+        return self.ws.send_str(frame)
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def __repr__(self) -> str:
+        protocol = "binary" if self.binary else "json"
+        return f"Client<{self.remote}>(protocol={protocol}, queued={len(self)}, dropped={self.dropped})"
@@ -3,17 +3,101 @@
 from abc import abstractmethod
 import asyncio
 from logging import getLogger
-from typing import Dict, Optional
+from random import random
+from time import monotonic
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, Set
 
 import aiohttp
+from yarl import URL
 
-from ..portfolio import Portfolio
+from .. import config as c
+from ..marketdata import MarketData
+from ..markets import Exchange, poll_interval
+from ..routing import Collector
+from ..serialize import deserialize
 from ..task import Task
 
 LOG = getLogger(__name__)
 
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 
-class WSClientTask(Task):
+
+class TokenBucket:
+    """Token bucket rate limiter, allows bursts of up to capacity requests and refills at rate tokens per second"""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Rate limits are shared by every collector talking to the same host
+_buckets: Dict[str, TokenBucket] = {}
+
+
+def rate_limiter(host: str) -> TokenBucket:
+    if host not in _buckets:
+        rate = c.HTTP_RATE_LIMITS.get(host, c.HTTP_RATE_LIMIT)
+        _buckets[host] = TokenBucket(rate, c.HTTP_RATE_BURST)
+    return _buckets[host]
+
+
+class CachedResponse:
+    __slots__ = ("data", "etag", "last_modified", "expires")
+
+    def __init__(self, data: Any, etag: Optional[str], last_modified: Optional[str], expires: float) -> None:
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+
+# Long-lived session shared by all collectors, keeps connections alive and cookies across collection cycles
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=c.HTTP_POOL_SIZE,
+            limit_per_host=c.HTTP_POOL_PER_HOST,
+            ttl_dns_cache=c.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=c.HTTP_KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.CookieJar())
+        LOG.debug("Created shared HTTP session")
+
+    return _session
+
+
+async def close_session():
+    global _session
+
+    if _session is not None:
+        LOG.debug("Closing shared HTTP session")
+        await _session.close()
+        _session = None
+
+
+class WSClientTask(Collector, Task):
     def __init__(
         self,
         uri: str,
@@ -32,7 +116,7 @@ class WSClientTask(Task):
             self._headers["Cookie"] = cookie
 
     async def connect(self, **kwargs):
-        self.session = aiohttp.ClientSession()
+        self.session = get_session()
         self.ws = await self.session.ws_connect(self._uri, origin=self._origin, headers=self._headers, **kwargs)
 
         LOG.info("[%s] Connected to server", self.name)
@@ -45,48 +129,145 @@ class WSClientTask(Task):
             LOG.debug("[%s] Closing WebSocket", self.name)
             await self.ws.close()
             self.ws = None
-        if self.session:
-            LOG.debug("[%s] Closing ClientSession", self.name)
-            await self.session.close()
-            self.session = None
+        self.session = None
 
         LOG.info("[%s] Stopped", self.name)
 
 
-class HTTPClientTask(Task):
-    def __init__(self, portfolio: Portfolio, *args, interval: int = 60, **kwargs) -> None:
+class HTTPClientTask(Collector, Task):
+    def __init__(self, market: MarketData, *args, interval: int = 60, **kwargs) -> None:
         super().__init__(*args, **kwargs)
-        self.portfolio = portfolio
+        self.market = market
+        # Regular polling interval while markets are open, the actual interval follows the market calendar
+        self.base_interval = interval
         self.interval = interval
         self.session = None
         self.running = False
         self.initial = True
+        self.cache: Dict[str, CachedResponse] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Tickers owned by this collector, kept up to date by the market data routes
+        self.tickers = market.routes.register(self)
+        # Tickers added since the previous collection started, and those added before the current one, which have
+        # no price from this collector yet. Adding tickers starts a collection right away
+        self.added: Set[str] = set()
+        self.fresh: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
 
     @abstractmethod
     async def collect(self):
         raise NotImplementedError()
 
+    def exchanges(self) -> Set[Optional[Exchange]]:
+        """Exchanges trading the instruments this collector polls, None for instruments polled at a fixed interval"""
+        return set()
+
+    async def routes_changed(self, added: Set[str], removed: Set[str]):
+        self.added = (self.added | added) - removed
+        if added and self._wakeup:
+            self._wakeup.set()
+
+    async def fetch_json(
+        self,
+        url: str,
+        method: str = "GET",
+        retries: int = c.HTTP_RETRIES,
+        ttl: float = 0,
+        changed_only: bool = False,
+        **kwargs,
+    ) -> Any:
+        """
+        Request a JSON document with bounded concurrency per collector and a rate limit per host. Connection errors,
+        timeouts and 429/5xx responses are retried with jittered exponential backoff.
+
+        GET responses are cached per URL and query parameters. Cached documents are revalidated with conditional
+        requests, so an unchanged document costs a 304 and no parsing, and are served without a request at all for
+        ttl seconds. With changed_only, None is returned instead of the cached document when nothing has changed.
+        """
+        key = str(URL(url).update_query(kwargs["params"])) if kwargs.get("params") else url
+        cached = self.cache.get(key) if method == "GET" else None
+
+        if cached is not None:
+            if cached.expires > monotonic():
+                return None if changed_only else cached.data
+
+            headers = dict(kwargs.pop("headers", None) or {})
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+            kwargs["headers"] = headers
+
+        bucket = rate_limiter(URL(url).host)
+
+        for attempt in range(retries + 1):
+            await bucket.acquire()
+            try:
+                async with self._semaphore:
+                    async with self.session.request(method, url, **kwargs) as resp:
+                        self.stats.messages += 1
+
+                        if resp.status == 304 and cached is not None:
+                            LOG.debug("[%s] %s not modified", self.name, url)
+                            cached.expires = monotonic() + ttl
+                            return None if changed_only else cached.data
+
+                        resp.raise_for_status()
+                        data = await resp.json(loads=deserialize)
+
+                        if method == "GET":
+                            etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+                            self.cache[key] = CachedResponse(data, etag, last_modified, monotonic() + ttl)
+
+                        return data
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retriable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRY_STATUSES
+                if not retriable or attempt == retries:
+                    raise
+
+                delay = c.HTTP_RETRY_BACKOFF * 2**attempt * (0.5 + random())
+                LOG.warning("[%s] Request to %s failed (%s), retrying in %.1fs", self.name, url, e, delay)
+                await asyncio.sleep(delay)
+
+    async def gather(self, requests: Iterable[Awaitable]) -> List[Any]:
+        """Run requests concurrently, failures are logged and counted without aborting the others"""
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception):
+                LOG.error("[%s] Request failed: %s", self.name, r)
+                self.stats.errors += 1
+
+        return results
+
     async def run(self):
         self.running = True
+        self._semaphore = asyncio.Semaphore(c.HTTP_CONCURRENCY)
+        self._wakeup = asyncio.Event()
 
         while self.running:
-            self.session = aiohttp.ClientSession()
-            async with self.session:
-                try:
-                    await self.collect()
-                except Exception as e:
-                    LOG.error("[%s] Failed to collect: %s", self.name, e)
-                    self.stats.errors += 1
+            self.session = get_session()
+            self.interval = poll_interval(self.exchanges(), self.base_interval)
+            self.fresh, self.added = self.added, set()
+            try:
+                await self.collect()
+            except Exception as e:
+                LOG.error("[%s] Failed to collect: %s", self.name, e)
+                self.stats.errors += 1
 
             self.initial = False
-            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
 
     async def stop(self):
         LOG.info("[%s] Stopping...", self.name)
 
         self.restart = False
-        if self.session is not None:
-            await self.session.close()
+        self.session = None
         self.running = False
+        if self._wakeup:
+            self._wakeup.set()
 
         LOG.info("[%s] Stopped", self.name)
@@ -2,7 +2,12 @@
 
 from datetime import timedelta
 from logging import getLogger
+from typing import Optional, Set
 
+from .. import config as c
+from ..config import Asset
+from ..markets import EXCHANGES, Exchange
+from ..portfolio import Position
 from .base import HTTPClientTask
 
 LOG = getLogger(__name__)
@@ -12,27 +17,36 @@ class EuronextFunds(HTTPClientTask):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, name="EuronextFunds", interval=3600, **kwargs)
 
+    def owns(self, position: Position) -> bool:
+        return position.asset in (Asset.FUND, Asset.INDEX_FUND) and position.collector == "default"
+
+    def exchanges(self) -> Set[Optional[Exchange]]:
+        return {self.market.positions[t].exchange for t in self.tickers}
+
     async def collect(self):
         LOG.info("[%s] Collecting equity fund market prices", self.name)
 
         url = "https://www.oslobors.no/ob/servlets/components"
         url += "?type=ranking&source=feed.omff.FUNDS&ranking=%2BSECURITYNAME&limit=2000&offset=0"
-        url += "&columns=ITEM%2C+SECURITYNAME%2C+PRICE%2C+TIME%2C&cutoffAtZero=false"
+        url += "&columns=ITEM%2C+PRICE&cutoffAtZero=false"
         url += "&channel=5ce3190cd4a87c8aebb2261d88a95c70"
         headers = {"User-Agent": "curl/7.68.0"}
 
-        async with self.session.get(url, headers=headers) as resp:
-            self.stats.messages += 1
-            updates = []
-            data = await resp.json()
+        # New funds are priced from the cached ranking, which is served without a request right after a poll
+        data = await self.fetch_json(url, headers=headers, ttl=c.HTTP_CACHE_TTL, changed_only=not self.fresh)
+        if data is None:
+            LOG.info("[%s] Fund ranking unchanged, sleeping for %s", self.name, timedelta(seconds=self.interval))
+            return
 
-            for row in data["rows"]:
-                ticker = row["key"]
-                if ticker in self.portfolio:
-                    nav = row["values"]["PRICE"]
-                    updates.append((ticker, nav))
+        updates = []
 
-            await self.portfolio.update(updates, initial=self.initial)
+        for row in data["rows"]:
+            ticker = row["key"]
+            if ticker in self.tickers:
+                nav = row["values"]["PRICE"]
+                updates.append((ticker, nav))
+
+        await self.market.update(updates, initial=self.initial)
 
         LOG.info("[%s] Equity fund market values collected, sleeping for %s", self.name, timedelta(seconds=self.interval))
 
@@ -41,24 +55,25 @@ class EuronextForex(HTTPClientTask):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, name="EuronextForex", interval=300, **kwargs)
 
+    def exchanges(self) -> Set[Exchange]:
+        return {EXCHANGES["FOREX"]}
+
     async def collect(self):
         LOG.info("[%s] Collecting exchange rates", self.name)
         url = "https://live.euronext.com/ajax/awlBlockFactory/detailedQuote"
         headers = {"User-Agent": "curl/7.68.0", "Content-Type": "application/x-www-form-urlencoded"}
 
-        payload = [f"isinmicArray%5B%5D={f}NOKFLIT.WFORX" for f in self.portfolio.exchange_rates.rates_by_ticker]
+        payload = [f"isinmicArray%5B%5D={f}NOKFLIT.WFORX" for f in self.market.exchange_rates.rates_by_ticker]
         payload = "&".join(payload)
 
-        async with self.session.post(url, data=payload, headers=headers) as resp:
-            data = await resp.json()
-            self.stats.messages += 1
-            data = data["detailedQuotes"]
-            updates = []
+        data = await self.fetch_json(url, method="POST", data=payload, headers=headers)
+        data = data["detailedQuotes"]
+        updates = []
 
-            for forex in self.portfolio.exchange_rates.rates_by_ticker:
-                last = float(data[f"{forex}NOKFLIT.WFORX"]["lastPrice"])
-                updates.append((forex, last))
+        for forex in self.market.exchange_rates.rates_by_ticker:
+            last = float(data[f"{forex}NOKFLIT.WFORX"]["lastPrice"])
+            updates.append((forex, last))
 
-            await self.portfolio.update(updates, initial=self.initial)
+        await self.market.update(updates, initial=self.initial)
 
         LOG.info("[%s] Exchange rates collected, sleeping for %s", self.name, timedelta(seconds=self.interval))
@@ -2,44 +2,87 @@
 
 import asyncio
 from logging import getLogger
+from typing import Dict, Optional, Set
 from uuid import uuid4
 
-from ..portfolio import Portfolio
+from .. import config as c
+from ..config import Asset
+from ..marketdata import MarketData
+from ..portfolio import Position
+from ..serialize import deserialize
 from .base import WSClientTask
 
 LOG = getLogger(__name__)
+INDEX = "OSEBX_OSE"
+QUOTE_COLUMNS = "ITEM%2CLONG_NAME%2CLAST"
+QUOTES = f"subscribe?initiatorComponent=Quotelist&source=feed.ob.quotes.EQUITIES%2BPCC&columns={QUOTE_COLUMNS}"
+
+
+def frame_key(data: str) -> Optional[str]:
+    """Instrument key of a quote frame without decoding the JSON, None for frames without one"""
+    i = data.find('"key"')
+    if i < 0:
+        return None
+    start = data.find('"', i + 5) + 1
+    return data[start : data.find('"', start)]
 
 
 class Finansavisen(WSClientTask):
-    def __init__(self, portfolio: Portfolio):
+    def __init__(self, market: MarketData):
         super().__init__(
             "wss://bors.finansavisen.no/server/components", "https://bors.finansavisen.no", name="Finansavisen"
         )
-        self.portfolio = portfolio
+        self.market = market
         self.subtasks = []
+        self.tickers = market.routes.register(self)
+        # Ticker of every quote subscription channel, and the channel of the full quote stream
+        self.channels: Dict[str, str] = {}
+        self.firehose_channel: Optional[str] = None
+        self.firehose = c.FINANSAVISEN_FIREHOSE
+        # Channels acknowledged with their initial data since subscribing
+        self.acked: Set[str] = set()
+
+    def owns(self, position: Position) -> bool:
+        funds = (Asset.FUND, Asset.INDEX_FUND)
+        return position.ticker.endswith("_OSE") and position.asset not in funds and position.collector == "default"
 
     async def run(self):
+        # Pings and subscription checks of a previous connection must not outlive it
+        await self.stop_subtasks()
         await self.connect()
+        # Every connection starts out in the configured mode, so filtered subscriptions get another chance
+        self.firehose = c.FINANSAVISEN_FIREHOSE
         self.subtasks = [asyncio.create_task(self._ping_task())]
-        await self.subscribe()
-
         try:
+            await self.subscribe()
+            if not self.firehose:
+                self.subtasks.append(asyncio.create_task(self._check_filtered()))
+
             await self.receive()
         except Exception as e:
             LOG.error("[%s] Exception during recv: %s (%s)", self.name, self.ws, e)
             self.stats.errors += 1
+        finally:
+            await self.stop_subtasks()
 
         LOG.warning("[%s] Disconnected", self.name)
-        await self.session.close()
+        await self.ws.close()
+
+    async def stop_subtasks(self):
+        for t in self.subtasks:
+            t.cancel()
+        await asyncio.gather(*self.subtasks, return_exceptions=True)
+        self.subtasks = []
 
     async def subscribe(self):
-        chan = str(uuid4())
-        cols = "ITEM%2CLONG_NAME%2CLAST"
-        req = "subscribe?initiatorComponent=Quotelist&source=feed.ob.quotes.EQUITIES%2BPCC"
-        req += f"&columns={cols}&channel={chan}"
+        self.channels = {}
+        self.firehose_channel = None
+        self.acked = set()
 
-        LOG.info("[%s] Subscribing to all tickers with channel id %s", self.name, chan)
-        await self.ws.send_str(req)
+        if self.firehose:
+            await self.subscribe_all()
+        else:
+            await self.subscribe_tickers(self.tickers)
 
         chan = str(uuid4())
         cols = "CHANGE_7DAYS_PCT%2CCHANGE_PCT%2CLAST"
@@ -48,13 +91,54 @@ class Finansavisen(WSClientTask):
         LOG.info("[%s] Subscribing to OSEBX Index with channel id %s", self.name, chan)
         await self.ws.send_str(req)
 
+    async def subscribe_all(self):
+        chan = self.firehose_channel = str(uuid4())
+        LOG.info("[%s] Subscribing to all tickers with channel id %s", self.name, chan)
+        await self.ws.send_str(f"{QUOTES}&channel={chan}")
+
+    async def subscribe_tickers(self, tickers: Set[str]):
+        """
+        Subscribe to quotes for the given tickers only. Instruments are subscribed to by item sector, like the OSEBX
+        index, which takes a single instrument per subscription.
+        """
+        for ticker in sorted(tickers):
+            # MOWI_OSE is item sector MOWI.OSE
+            sector = ".".join(ticker.rsplit("_", 1))
+            chan = str(uuid4())
+            self.channels[chan] = ticker
+
+            LOG.debug("[%s] Subscribing to %s with channel id %s", self.name, ticker, chan)
+            await self.ws.send_str(f"subscribe?itemSector={sector}&columns={QUOTE_COLUMNS}&channel={chan}")
+
+    async def unsubscribe_tickers(self):
+        for chan in list(self.channels):
+            await self.ws.send_str(f"unsubscribe?channel={chan}")
+        self.channels = {}
+
+    async def routes_changed(self, added: Set[str], removed: Set[str]):
+        if self.firehose or self.ws is None or self.ws.closed:
+            return
+
+        for chan, ticker in list(self.channels.items()):
+            if ticker in removed:
+                LOG.info("[%s] Unsubscribing from %s with channel id %s", self.name, ticker, chan)
+                await self.ws.send_str(f"unsubscribe?channel={chan}")
+                del self.channels[chan]
+
+        await self.subscribe_tickers(added)
+
     async def receive(self):
         async for msg in self.ws:
             self.stats.messages += 1
             if msg.data == "pong":
                 continue
 
-            data = msg.json()
+            # Most of the quote stream is for instruments not held, skip those before decoding
+            key = frame_key(msg.data)
+            if key is not None and key != INDEX and key not in self.tickers and "initial_data_sent" not in msg.data:
+                continue
+
+            data = msg.json(loads=deserialize)
 
             if "values" not in data:
                 continue
@@ -63,14 +147,15 @@ class Finansavisen(WSClientTask):
             values = data["values"]
 
             if msg_type == "meta" and "initial_data_sent" in values and values["initial_data_sent"]:
-                LOG.info("[%s] Initial data received", self.name)
+                LOG.debug("[%s] Initial data received on channel %s", self.name, data.get("channel"))
+                self.acked.add(data.get("channel"))
                 continue
 
             ticker = data["key"]
             initial = msg_type == "new"
 
-            if ticker == "OSEBX_OSE":
-                await self.portfolio.update_index(
+            if ticker == INDEX:
+                await self.market.update_index(
                     ticker,
                     "Oslo Børs (OSEBX)",
                     values.get("LAST", 0) or 0.0,
@@ -78,18 +163,49 @@ class Finansavisen(WSClientTask):
                     round(values.get("CHANGE_7DAYS_PCT") or 0.0, 2),
                 )
 
-            if ticker in self.portfolio:
+            if ticker in self.tickers:
                 if "LAST" in values and values["LAST"] is not None:
-                    await self.portfolio.update((ticker, values["LAST"]), initial=initial)
+                    await self.market.update((ticker, values["LAST"]), initial=initial)
 
     async def stop(self):
         await super().stop()
         LOG.debug("[%s] Stopping subtasks ...", self.name)
-        for t in self.subtasks:
-            t.cancel()
-            await t
+        await self.stop_subtasks()
         LOG.debug("[%s] Subtasks stopped", self.name)
 
+    async def _check_filtered(self):
+        """
+        Fall back to the full quote stream while the filtered subscriptions aren't acknowledged with their initial
+        data. Quotes may not arrive for hours outside trading hours, the initial data is sent right away.
+        """
+        while True:
+            await asyncio.sleep(c.FINANSAVISEN_FILTER_TIMEOUT)
+            missing = [ticker for chan, ticker in self.channels.items() if chan not in self.acked]
+            if self.ws is None or self.ws.closed or not missing:
+                return
+
+            LOG.warning(
+                "[%s] %d of %d subscriptions got no initial data (%s), falling back to all tickers",
+                self.name,
+                len(missing),
+                len(self.channels),
+                ", ".join(sorted(missing)),
+            )
+            await self.unsubscribe_tickers()
+            self.firehose = True
+            await self.subscribe_all()
+
+            await asyncio.sleep(c.FINANSAVISEN_FILTER_RETRY)
+            if self.ws is None or self.ws.closed:
+                return
+
+            LOG.info("[%s] Retrying subscriptions to %d held tickers", self.name, len(self.tickers))
+            await self.ws.send_str(f"unsubscribe?channel={self.firehose_channel}")
+            self.firehose = False
+            self.firehose_channel = None
+            self.acked = set()
+            await self.subscribe_tickers(self.tickers)
+
     async def _ping_task(self):
         while True:
             await asyncio.sleep(30)
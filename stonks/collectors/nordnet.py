@@ -1,57 +1,93 @@
 """NordNet Collectors"""
 
-from asyncio import sleep
+import asyncio
 from datetime import timedelta
 from logging import getLogger
+from typing import Optional, Set
 
+from aiohttp import ClientResponseError
+
+from ..markets import Exchange
+from ..portfolio import Position
 from .base import HTTPClientTask
 
 LOG = getLogger(__name__)
+DATA_URL = "https://www.nordnet.no/api/2/instrument_search/query/fundlist"
+LOGIN_URL = "https://www.nordnet.no/api/2/login"
+HEADERS = {
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Accept-Language": "en-US,en;q=0.9",
+    "client-id": "NEXT",
+    "Connection": "keep-alive",
+    "Host": "www.nordnet.no",
+    "Referer": "https://www.nordnet.no/",
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": "Windows",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-origin",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/94.0.4606.61 Safari/537.36"
+}
 
 
 class NordNetFunds(HTTPClientTask):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, name="NordNetFunds", interval=3600, **kwargs)
+        # Bumped on every login, so concurrent requests failing on the same expired session only log in once
+        self.session_generation = 0
+        self.authenticated = False
+        self._login_lock: Optional[asyncio.Lock] = None
+
+    async def login(self, expired: Optional[int] = None):
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+
+        async with self._login_lock:
+            if self.authenticated and expired != self.session_generation:
+                return
+
+            LOG.info("[%s] Authenticating", self.name)
+            self.authenticated = False
+            # Get NextJS cookies
+            async with self.session.get("https://www.nordnet.no/") as resp:
+                resp.raise_for_status()
+            # Do NextJS login GET
+            async with self.session.get(LOGIN_URL, headers=HEADERS) as resp:
+                resp.raise_for_status()
+
+            self.authenticated = True
+            self.session_generation += 1
+
+    def owns(self, position: Position) -> bool:
+        return position.collector == "nordnet"
+
+    def exchanges(self) -> Set[Optional[Exchange]]:
+        return {self.market.positions[t].exchange for t in self.tickers}
 
     async def collect(self):
         LOG.info("[%s] Collecting equity fund market prices", self.name)
 
-        data_url = "https://www.nordnet.no/api/2/instrument_search/query/fundlist"
-        login_url = "https://www.nordnet.no/api/2/login"
-        headers = {
-            "Accept": "application/json",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Accept-Language": "en-US,en;q=0.9",
-            "client-id": "NEXT",
-            "Connection": "keep-alive",
-            "Host": "www.nordnet.no",
-            "Referer": "https://www.nordnet.no/",
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": "Windows",
-            "Sec-Fetch-Dest": "empty",
-            "Sec-Fetch-Mode": "cors",
-            "Sec-Fetch-Site": "same-origin",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/94.0.4606.61 Safari/537.36"
-        }
-
-        # Get NextJS cookies
-        async with self.session.get("https://www.nordnet.no/") as resp:
-            resp.raise_for_status()
-        # Do NextJS login GET
-        async with self.session.get(login_url, headers=headers) as resp:
-            resp.raise_for_status()
-        # Actually start fetching data
-        for p in self.portfolio.positions.values():
-            if p.collector != "nordnet":
-                continue
-
-            instrument_uri = f"{data_url}?apply_filters=instrument_id={p.ticker}"
-            async with self.session.get(instrument_uri, headers=headers) as resp:
-                self.stats.messages += 1
-                data = await resp.json()
-                if data and data["results"]:
-                    nav = data["results"][0]["price_info"]["last"]["price"]
-                    await self.portfolio.update((p.ticker, nav), initial=self.initial)
-                await sleep(0.5)
+        # Cookies live in the shared session, only log in once or when the session has expired
+        if not self.authenticated:
+            await self.login()
+
+        tickers = list(self.tickers)
+        await self.gather(self.collect_instrument(f"{DATA_URL}?apply_filters=instrument_id={t}", t) for t in tickers)
 
         LOG.info("[%s] Equity fund market values collected, sleeping for %s", self.name, timedelta(seconds=self.interval))
+
+    async def collect_instrument(self, url: str, ticker: str):
+        generation = self.session_generation
+        try:
+            data = await self.fetch_json(url, headers=HEADERS, changed_only=ticker not in self.fresh)
+        except ClientResponseError as e:
+            if e.status not in (401, 403):
+                raise
+            LOG.info("[%s] Session expired (%s), re-authenticating", self.name, e.status)
+            await self.login(expired=generation)
+            data = await self.fetch_json(url, headers=HEADERS, changed_only=ticker not in self.fresh)
+
+        if data and data["results"]:
+            nav = data["results"][0]["price_info"]["last"]["price"]
+            await self.market.update((ticker, nav), initial=self.initial)
@@ -5,7 +5,7 @@ from logging import getLogger
 from random import choice, random
 
 from ..config import SIMULATOR_MAX_TICKER_INTERVAL
-from ..portfolio import Portfolio
+from ..marketdata import MarketData
 from ..task import Task
 
 LOG = getLogger(__name__)
@@ -17,20 +17,20 @@ class Simulator(Task):
     entries in the portfolio. Make sure there are some entries in the config file first.
     """
 
-    def __init__(self, portfolio: Portfolio) -> None:
+    def __init__(self, market: MarketData) -> None:
         super().__init__(name="Simulator")
-        self.portfolio = portfolio
+        self.market = market
         self.running = False
 
     async def run(self):
         self.running = True
 
         while self.running:
-            if self.portfolio.positions:
-                t = choice(list(self.portfolio.positions.values()))
+            if self.market.positions:
+                t = choice(list(self.market.positions.values()))
                 last = t.market_price
                 new = last + (random() - 0.5) * last * 0.02
-                await self.portfolio.update((t.ticker, round(new, 2)))
+                await self.market.update((t.ticker, round(new, 2)))
             else:
                 LOG.error("[%s] Cannot simulate, no positions in portfolio", self.name)
             await sleep(random() * SIMULATOR_MAX_TICKER_INTERVAL)
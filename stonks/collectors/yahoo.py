@@ -1,59 +1,57 @@
 """Yahoo Finance Collector"""
 
-from asyncio import sleep
-from datetime import datetime, timedelta
+from datetime import timedelta
 from logging import getLogger
+from typing import Optional, Set
 
 from ..config import Asset
+from ..markets import Exchange
+from ..portfolio import Position
 from .base import HTTPClientTask
 
 LOG = getLogger(__name__)
-URL = "https://query1.finance.yahoo.com/v8/finance/chart/{ticker}?range=1d&interval=1m"
+# A single daily bar is enough, its close is the last traded price
+URL = "https://query1.finance.yahoo.com/v8/finance/chart/{ticker}?range=1d&interval=1d"
 
 
 class YahooFinance(HTTPClientTask):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, name="YahooFinance", interval=60, **kwargs)
 
+    def owns(self, position: Position) -> bool:
+        return position.asset in (Asset.ETF, Asset.INDEX_ETF)
+
+    def exchanges(self) -> Set[Optional[Exchange]]:
+        return {self.market.positions[t].exchange for t in self.tickers}
+
     async def collect(self):
         LOG.info("[%s] Collecting market prices", self.name)
 
-        for pos in self.portfolio.positions.values():
-            if pos.asset not in (Asset.ETF, Asset.INDEX_ETF):
-                continue
-            ticker = pos.ticker
-            LOG.debug("[%s] Collecting market price for %s", self.name, ticker)
-
-            try:
-                async with self.session.get(URL.format(ticker=ticker)) as resp:
-                    nav = None
-                    self.stats.messages += 1
-                    data = await resp.json()
-                    meta = data["chart"]["result"][0]["meta"]
-                    quote = data["chart"]["result"][0]["indicators"]["quote"][0]
-
-                    if quote:
-                        for i in reversed(quote.get("close")):
-                            if i is not None:
-                                nav = round(i, 4)
-                                break
-                    else:
-                        LOG.debug("[%s] No quote available for %s, grabbing previous close", self.name, ticker)
-                        nav = round(meta["previousClose"], 4)
-                    if nav is not None:
-                        await self.portfolio.update((ticker, nav), initial=self.initial)
-            except Exception as e:
-                LOG.error("[%s] Failed to collect market price for: %s: %s", self.name, ticker, e)
-                self.stats.errors += 1
-            await sleep(1)
-
-        now = datetime.now()
-        if (now.hour > 18 or now.hour < 8):
-            if self.interval != 3600:
-                LOG.info("[%s] Switching to hourly interval, now outside market hours", self.name)
-                self.interval = 3600
-        elif self.interval != 60:
-            LOG.info("[%s] Switching to one minute interval, now approaching market hours", self.name)
-            self.interval = 60
+        await self.gather(self.collect_ticker(ticker) for ticker in list(self.tickers))
 
         LOG.info("[%s] Market prices collected, sleeping for %s", self.name, timedelta(seconds=self.interval))
+
+    async def collect_ticker(self, ticker: str):
+        LOG.debug("[%s] Collecting market price for %s", self.name, ticker)
+
+        try:
+            nav = None
+            data = await self.fetch_json(URL.format(ticker=ticker))
+            meta = data["chart"]["result"][0]["meta"]
+            quote = data["chart"]["result"][0]["indicators"]["quote"][0]
+
+            if meta.get("regularMarketPrice") is not None:
+                nav = round(meta["regularMarketPrice"], 4)
+            elif quote:
+                for i in reversed(quote.get("close")):
+                    if i is not None:
+                        nav = round(i, 4)
+                        break
+            else:
+                LOG.debug("[%s] No quote available for %s, grabbing previous close", self.name, ticker)
+                nav = round(meta["previousClose"], 4)
+            if nav is not None:
+                await self.market.update((ticker, nav), initial=self.initial)
+        except Exception as e:
+            LOG.error("[%s] Failed to collect market price for: %s: %s", self.name, ticker, e)
+            self.stats.errors += 1
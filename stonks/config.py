@@ -2,10 +2,11 @@
 Stonks config options
 """
 
-from dateutil.relativedelta import relativedelta
+from dateutil.relativedelta import MO, relativedelta
 from enum import Enum
 from os.path import abspath, dirname, join
 from logging import INFO
+from typing import Optional
 from zoneinfo import ZoneInfo
 
 
@@ -32,27 +33,129 @@ class Asset(Enum):
     FOREX: str = "Forex"
 
 
+class Resolution(Enum):
+    MINUTE: str = "1m"
+    HOUR: str = "1h"
+    DAY: str = "1d"
+    WEEK: str = "1w"
+
+
+# Collectors
+
+# Shared HTTP connection pool, max connections in total and per host, DNS cache TTL and keep-alive in seconds
+HTTP_POOL_SIZE: int = 100
+HTTP_POOL_PER_HOST: int = 8
+HTTP_DNS_CACHE_TTL: int = 300
+HTTP_KEEPALIVE_TIMEOUT: float = 60.0
+# Max concurrent requests per HTTP collector
+HTTP_CONCURRENCY: int = 4
+# Requests per second per upstream host, shared by all collectors, and how many requests may burst at once
+HTTP_RATE_LIMIT: float = 2.0
+HTTP_RATE_LIMITS = {
+    "query1.finance.yahoo.com": 4.0,
+}
+HTTP_RATE_BURST: int = 4
+# Retry failed requests up to N times, with a jittered exponential backoff starting at N seconds
+HTTP_RETRIES: int = 3
+HTTP_RETRY_BACKOFF: float = 1.0
+# Serve a GET response fetched less than N seconds ago without a request, like when pricing positions added one
+# after the other. Keep it below the shortest polling interval, so regular polls always go out
+HTTP_CACHE_TTL: float = 15.0
+
+# Subscribe to the full Oslo Børs quote stream instead of the held instruments only
+FINANSAVISEN_FIREHOSE: bool = False
+# Fall back to the full quote stream if the subscriptions to held instruments aren't acknowledged with their initial
+# data within N seconds, and try them again after N seconds
+FINANSAVISEN_FILTER_TIMEOUT: float = 30.0
+FINANSAVISEN_FILTER_RETRY: float = 3600.0
+# Poll N times as often within N seconds of a market open or close
+MARKET_EDGE_SPEEDUP: float = 2.0
+MARKET_EDGE_WINDOW: int = 15 * 60
+# Keep polling at the regular interval for N seconds after a market closes, delayed feeds send the closing prices late
+MARKET_CLOSE_GRACE: int = 3600
+# While markets are closed, poll at the next open but at least every N seconds
+MARKET_CLOSED_MAX_INTERVAL: int = 4 * 3600
+# Collectors in worker processes send their price updates to the core in batches every N seconds
+WORKER_FLUSH_INTERVAL: float = 0.25
+# Wait N seconds for a worker process to exit when stopping, before killing it
+WORKER_STOP_TIMEOUT: float = 5.0
+
 # Dashboard public root folder
 PUB_ROOT = join(dirname(abspath(__file__)), "dashboard", "build")
 
+# Database
+
+# Flush queued database writes every N seconds, or as soon as N rows are queued
+DB_FLUSH_INTERVAL: float = 5.0
+DB_FLUSH_SIZE: int = 500
+# Give up on a batch after N writes failed on a locked or busy database, the rows are dropped
+DB_WRITE_ATTEMPTS: int = 5
+# Memory map up to N bytes of the SQLite database file for fast range reads
+DB_MMAP_SIZE: int = 256 * 1024 * 1024
+# Record every accepted price update in the tick store. Only done with a database file, in memory the ticks would
+# pile up for as long as the process runs
+TICK_STORE: bool = True
+
+# Dashboard
+
+# JSON codec for WebSocket frames and collector responses, json, orjson or msgspec. None picks the fastest one
+# installed
+JSON_CODEC: Optional[str] = None
+# Offer permessage-deflate compression to WebSocket clients, clients may opt out with ?compress=0
+WS_COMPRESS: bool = True
+# Compression level of the precompressed snapshots served over HTTP
+SNAPSHOT_GZIP_LEVEL: int = 6
+# Max frames queued per WebSocket client before the oldest ones are dropped
+CLIENT_SEND_QUEUE_SIZE: int = 256
+# Disconnect a WebSocket client if a single send stalls for N seconds
+CLIENT_SEND_TIMEOUT: float = 10.0
+# Port the dashboard is served on
+PORT: int = 8080
+# Unix socket the primary serves its event stream to fan-out processes on
+FANOUT_SOCKET: str = "/tmp/stonks.sock"
+# Refresh the snapshots cached by fan-out processes every N seconds, new clients are sent the deltas since
+FANOUT_SNAPSHOT_INTERVAL: float = 10.0
+# Disconnect a fan-out process falling N messages behind, it resyncs from fresh snapshots when it reconnects
+FANOUT_QUEUE_SIZE: int = 10000
+
+# Events
+
+# Max events queued per observer with queued dispatch
+EVENT_QUEUE_SIZE: int = 1000
+
 # Formatting
 
 PRECISION: int = 2
 
 # Portfolio
 
-# Wait 250 ms between processing cycle of the portfolio ticker buffer
 # Just some initial values for Forex rates
 FOREX = [
     ("SEK", "SEK", 1.0),
     ("EUR", "EUR", 10.0),
     ("USD", "USD", 8.5),
 ]
-PROCESSING_INTERVAL: float = 0.25
+# Processing wakes up as soon as ticker updates arrive, then waits at least 250 ms so bursts are coalesced
+PROCESSING_MIN_INTERVAL: float = 0.25
+# Max tickers processed per cycle, the remaining updates are carried over to the next cycle
+PROCESSING_MAX_BATCH: int = 1000
+# Portfolios with at least N positions are kept in the array backed position store
+COLUMNAR_STORE_THRESHOLD: int = 1000
 # How many hours of history
 HISTORY_BUFFER: int = 96
 # DB persist interval
 CLOSE_INTERVAL = relativedelta(hours=1, minute=0, second=0, microsecond=0)
+# Candle resolutions aggregated from portfolio ticks, with bucket interval and number of candles to keep
+RESOLUTIONS = {
+    Resolution.MINUTE: (relativedelta(minutes=1, second=0, microsecond=0), 24 * 60),
+    Resolution.HOUR: (CLOSE_INTERVAL, 24 * 366),
+    Resolution.DAY: (relativedelta(days=1, hour=0, minute=0, second=0, microsecond=0), 366 * 5),
+    Resolution.WEEK: (relativedelta(days=1, weekday=MO, hour=0, minute=0, second=0, microsecond=0), 52 * 10),
+}
+# Max number of candles in a chart series sent to the dashboard, longer ranges are downsampled
+CHART_MAX_POINTS: int = 500
+# Chart requests are limited to timestamps between the epoch and this one (2100-01-01)
+CHART_MAX_TIMESTAMP: int = 4102444800
 
 # Testing
 
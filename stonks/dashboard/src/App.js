@@ -9,6 +9,7 @@ import Positions from './Positions'
 import { Summary } from './Summary'
 import Status from './Status'
 import Candlesticks from './Candlesticks'
+import BinaryDecoder from './protocol'
 
 import './css/App.css'
 
@@ -16,11 +17,15 @@ function getWebSocketURI() {
   let host = window.location.host
   const local = host.startsWith("localhost") || host.startsWith("127.0.0.1")
   host = local ? `${window.location.hostname}:8080` : host
-  return `${window.location.href.startsWith("https") ? "wss" : "ws"}://${host}/ws`
+  // ?portfolio=<name> shows one of the other portfolios served by the backend
+  const portfolio = new URLSearchParams(window.location.search).get("portfolio")
+  const path = portfolio ? `/ws/${encodeURIComponent(portfolio)}` : "/ws"
+  return `${window.location.href.startsWith("https") ? "wss" : "ws"}://${host}${path}?protocol=binary`
 }
 
 function connectWebSocket({ onOpen, onMessage, onClose }) {
   const ws = new WebSocket(getWebSocketURI())
+  ws.binaryType = "arraybuffer"
   ws.onopen = onOpen
   ws.onmessage = onMessage
   ws.onclose = onClose
@@ -34,6 +39,16 @@ function App() {
   const feed = useRef()
   const plot = useRef()
   const status = useRef()
+  const seq = useRef(null)
+  const resyncTimer = useRef(null)
+  const resolution = useRef("1h")
+  const chartRequested = useRef(0)
+  const positionsByTicker = useRef({})
+  // Frames referring to instruments missing from the snapshot mean the snapshot is out of date
+  const decoder = useRef(new BinaryDecoder(id => {
+    console.warn(`Unknown instrument id ${id}, requesting resync`)
+    requestResync()
+  }))
 
   const [positions, setPositions] = useState([])
   const [forexData, setForexData] = useState({})
@@ -51,10 +66,16 @@ function App() {
   }, [ws])
 
   function handleMessage(msg) {
-    const event = JSON.parse(msg.data)
+    // Ticker, chart tick and delta events arrive as binary frames, everything else as JSON
+    const event = typeof msg.data === "string" ? JSON.parse(msg.data) : decoder.current.decode(msg.data)
     const data = event.data
 
     if (event.type === "portfolio") {
+      decoder.current.setSnapshot(data)
+      seq.current = data.seq
+      clearTimeout(resyncTimer.current)
+      resyncTimer.current = null
+      positionsByTicker.current = Object.fromEntries(data.positions.map(p => [p.ticker, p]))
       setPositions(data.positions)
       setComposition(data.composition)
       setForexData(data.exchange_rates)
@@ -64,12 +85,18 @@ function App() {
         netReturn: data.net_return,
         netReturnPercent: data.net_return_percent
       })
+    } else if (event.type === "portfolio_delta") {
+      applyDelta(data)
     } else if (event.type === "chart") {
-      plot.current.setData(data)
+      if (resolution.current === "1h") plot.current.setData(data)
     } else if (event.type === "chart_tick") {
-      plot.current.updateLast(data)
+      // Ticks are hourly candles, other resolutions are refreshed from the server at most once a minute
+      if (resolution.current === "1h") plot.current.updateLast(data)
+      else if (Date.now() - chartRequested.current > 60000) requestChart(resolution.current)
+    } else if (event.type === "chart_series") {
+      if (data.resolution === resolution.current) plot.current.setData(data.candles)
     } else if (event.type === "ticker") {
-      feed.current.addTicker(data)
+      if (data) feed.current.addTicker(data)
     } else if (event.type === "close") {
       // dailyCloses.current.setCloses(data)
     } else if (event.type === "index") {
@@ -80,6 +107,50 @@ function App() {
     else status.current.setState(data)
   }
 
+  function applyDelta(delta) {
+    // Waiting for a resync, or a delta already covered by the last snapshot
+    if (seq.current === null || delta.seq <= seq.current) return
+
+    if (delta.seq !== seq.current + 1) {
+      console.warn(`Missed portfolio updates (${seq.current} -> ${delta.seq}), requesting resync`)
+      requestResync()
+      return
+    }
+    seq.current = delta.seq
+
+    const byTicker = positionsByTicker.current
+    delta.positions.forEach(p => { byTicker[p.ticker] = p })
+    setPositions(Object.values(byTicker).map(p => {
+      return { ...p, allocation: Math.round(p.market_value / (delta.market_value || 1) * 1000) / 10 }
+    }))
+    setComposition(prev => ({ ...prev, ...delta.composition }))
+    setForexData(prev => ({ ...prev, ...delta.exchange_rates }))
+    summary.current.setState({
+      marketValue: delta.market_value,
+      netReturn: delta.net_return,
+      netReturnPercent: delta.net_return_percent
+    })
+  }
+
+  function requestResync() {
+    // Deltas are ignored until the snapshot arrives, ask again in case the reply never does
+    seq.current = null
+    clearTimeout(resyncTimer.current)
+    resyncTimer.current = setTimeout(() => {
+      if (seq.current === null && ws.current.readyState === WebSocket.OPEN) {
+        console.warn("No portfolio snapshot received, requesting resync again")
+        requestResync()
+      }
+    }, 5000)
+    ws.current.send("resync")
+  }
+
+  function requestChart(res) {
+    resolution.current = res
+    chartRequested.current = Date.now()
+    ws.current.send(JSON.stringify({ type: "chart", resolution: res }))
+  }
+
   function reconnect(seconds) {
     setTimeout(() => {
       console.info("Reconnecting to Stonks")
@@ -143,7 +214,7 @@ function App() {
         </section>
       </div>
       <div id="chart">
-        <Candlesticks ref={plot} />
+        <Candlesticks ref={plot} onResolution={requestChart} />
       </div>
     </main>
   )
@@ -1,6 +1,7 @@
 import Chart from "react-apexcharts"
 import React from "react"
 
+const RESOLUTIONS = ["1m", "1h", "1d", "1w"]
 
 export default class Candlesticks extends React.Component {
   constructor(props) {
@@ -28,10 +29,16 @@ export default class Candlesticks extends React.Component {
         theme: { mode: "dark" },
         // colors: ["#7e9724"]
       },
-      series: [{ name: "Hourly", data: [] }]
+      series: [{ name: "Hourly", data: [] }],
+      resolution: "1h"
     }
   }
 
+  selectResolution(resolution) {
+    this.setState({ resolution })
+    if (this.props.onResolution) this.props.onResolution(resolution)
+  }
+
   updateLast(data) {
     const items = [...this.state.series[0].data]
     items[items.length - 1] = {
@@ -52,8 +59,17 @@ export default class Candlesticks extends React.Component {
   }
 
   render() {
+    const resolutions = RESOLUTIONS.map(r => (
+      <button key={r} className={r === this.state.resolution ? "active" : ""} onClick={() => this.selectResolution(r)}>
+        {r}
+      </button>
+    ))
+
     return (
-      <Chart options={this.state.options} series={this.state.series} type="candlestick" width="100%" height="320" />
+      <>
+        <div id="resolutions">{resolutions}</div>
+        <Chart options={this.state.options} series={this.state.series} type="candlestick" width="100%" height="320" />
+      </>
     )
   }
 }
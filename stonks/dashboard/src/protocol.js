@@ -0,0 +1,118 @@
+// Decoder for the binary dashboard protocol, frame layouts are described in stonks/protocol.py
+
+const TICKER = 1
+const CHART_TICK = 2
+const PORTFOLIO_DELTA = 3
+
+const DELTA_HEADER = 42
+const DELTA_POSITION = 18
+const DELTA_FOREX = 10
+const DELTA_COMPOSITION = 9
+
+function round(value, decimals) {
+  const f = 10 ** decimals
+  return Math.round(value * f) / f
+}
+
+class BinaryDecoder {
+  // onUnknown is called once per snapshot when a frame refers to an instrument the snapshot didn't list
+  constructor(onUnknown = () => {}) {
+    this.positions = {}
+    this.forex = {}
+    this.assets = []
+    this.onUnknown = onUnknown
+    this.unknown = false
+  }
+
+  // Instrument ids and asset classes come with every portfolio snapshot
+  setSnapshot(data) {
+    this.positions = Object.fromEntries(data.positions.map(p => [p.id, p]))
+    this.forex = Object.fromEntries(Object.values(data.exchange_rates).map(f => [f.id, f]))
+    this.assets = data.assets
+    this.unknown = false
+  }
+
+  decode(buffer) {
+    const view = new DataView(buffer)
+
+    switch (view.getUint8(0)) {
+      case TICKER:
+        return {
+          type: "ticker",
+          data: this.ticker(view.getUint16(1, true), view.getFloat64(3, true), view.getFloat64(11, true))
+        }
+      case CHART_TICK:
+        return {
+          type: "chart_tick",
+          data: {
+            time: view.getUint32(1, true),
+            open: view.getFloat64(5, true),
+            high: view.getFloat64(13, true),
+            low: view.getFloat64(21, true),
+            close: view.getFloat64(29, true)
+          }
+        }
+      case PORTFOLIO_DELTA:
+        return { type: "portfolio_delta", data: this.delta(view) }
+      default:
+        return { type: "unknown", data: null }
+    }
+  }
+
+  ticker(id, price, value) {
+    if (id in this.forex) {
+      this.forex[id] = { ...this.forex[id], market_price: price }
+      return this.forex[id]
+    }
+
+    // Frames from before the snapshot, or for positions added since, can't be decoded without a new one
+    const p = this.positions[id]
+    if (p === undefined) {
+      if (!this.unknown) {
+        this.unknown = true
+        this.onUnknown(id)
+      }
+      return null
+    }
+
+    this.positions[id] = {
+      ...p,
+      market_price: price,
+      market_value: value,
+      net_return: round(value - p.cost, 2),
+      net_return_percent: round(100 * (value - p.cost) / p.cost, 2)
+    }
+    return this.positions[id]
+  }
+
+  delta(view) {
+    const delta = {
+      seq: view.getUint32(1, true),
+      market_value: view.getFloat64(5, true),
+      net_return: view.getFloat64(13, true),
+      net_return_percent: view.getFloat64(21, true),
+      cost: view.getFloat64(29, true),
+      positions: [],
+      exchange_rates: {},
+      composition: {}
+    }
+    let offset = DELTA_HEADER
+
+    for (let i = 0; i < view.getUint16(37, true); i++, offset += DELTA_POSITION) {
+      const id = view.getUint16(offset, true)
+      const p = this.ticker(id, view.getFloat64(offset + 2, true), view.getFloat64(offset + 10, true))
+      if (p !== null) delta.positions.push(p)
+    }
+    for (let i = 0; i < view.getUint16(39, true); i++, offset += DELTA_FOREX) {
+      const f = this.ticker(view.getUint16(offset, true), view.getFloat64(offset + 2, true))
+      if (f !== null) delta.exchange_rates[f.name] = f
+    }
+    for (let i = 0; i < view.getUint8(41); i++, offset += DELTA_COMPOSITION) {
+      delta.composition[this.assets[view.getUint8(offset)]] = view.getFloat64(offset + 1, true)
+    }
+
+    return delta
+  }
+}
+
+export default BinaryDecoder
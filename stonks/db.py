@@ -1,52 +1,274 @@
 """Historical database"""
 
+import asyncio
+from datetime import datetime
 from logging import getLogger
-from typing import List
+from time import time
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import sqlalchemy as sa
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from .config import HISTORY_BUFFER
-from .history import CandleStick
+from .config import (
+    DB_FLUSH_INTERVAL,
+    DB_FLUSH_SIZE,
+    DB_MMAP_SIZE,
+    DB_WRITE_ATTEMPTS,
+    HISTORY_BUFFER,
+    RESOLUTIONS,
+    TICK_STORE,
+    TZ,
+    Resolution,
+)
+from .history import CandleSeries, CandleStick
 
 LOG = getLogger(__name__)
 
 metadata = sa.MetaData()
-history_table = sa.Table(
-    "history",
+candle_tables: Set[str] = set()
+
+
+def candle_table(name: str) -> sa.Table:
+    """Hourly candlestick history of a portfolio, every portfolio has a table of its own"""
+    if name not in metadata.tables:
+        candle_tables.add(name)
+        sa.Table(
+            name,
+            metadata,
+            sa.Column("time", sa.Integer, primary_key=True),
+            sa.Column("open", sa.Integer, nullable=False),
+            sa.Column("high", sa.Integer, nullable=False),
+            sa.Column("low", sa.Integer, nullable=False),
+            sa.Column("close", sa.Integer, nullable=False),
+        )
+    return metadata.tables[name]
+
+
+history_table = candle_table("history")
+tickers_table = sa.Table(
+    "tickers",
     metadata,
-    sa.Column("time", sa.Integer, primary_key=True),
-    sa.Column("open", sa.Integer, nullable=False),
-    sa.Column("high", sa.Integer, nullable=False),
-    sa.Column("low", sa.Integer, nullable=False),
-    sa.Column("close", sa.Integer, nullable=False),
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("ticker", sa.String, nullable=False, unique=True),
 )
+# Append-only tick store, time in milliseconds. The index covers range reads per ticker without table lookups
+ticks_table = sa.Table(
+    "ticks",
+    metadata,
+    sa.Column("time", sa.Integer, nullable=False),
+    sa.Column("ticker_id", sa.Integer, nullable=False),
+    sa.Column("price", sa.Float, nullable=False),
+    sa.Index("ix_ticks_ticker_id_time_price", "ticker_id", "time", "price"),
+)
+
+
+def insert(table: sa.Table) -> sa.sql.Insert:
+    """
+    A candlestick replaces any stored for the same time, like the hour being closed again after a restart. The
+    other tables are append-only, a conflict there is an error to surface and not something to overwrite.
+    """
+    stmt = table.insert()
+    return stmt.prefix_with("OR REPLACE") if table.name in candle_tables else stmt
+
+
+def configure_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    cursor.close()
 
 
 class Database:
+    """
+    Write-behind database. Writes are queued in memory and flushed in batches, one multi-row insert per table
+    in a single transaction, either every DB_FLUSH_INTERVAL seconds or as soon as DB_FLUSH_SIZE rows are queued.
+    Queued rows are flushed before the engine is disposed on shutdown.
+    """
+
     def __init__(self, connection_string: str = "sqlite+aiosqlite://") -> None:
-        self.engine: AsyncEngine = create_async_engine(connection_string)
+        url = sa.engine.make_url(connection_string)
+        in_memory = url.database in (None, "", ":memory:")
+
+        if in_memory:
+            self.engine: AsyncEngine = create_async_engine(connection_string)
+        else:
+            self.engine: AsyncEngine = create_async_engine(connection_string, poolclass=AsyncAdaptedQueuePool)
+            sa.event.listen(self.engine.sync_engine, "connect", configure_sqlite)
+
+        # Ticks are only recorded to disk, an in-memory store would grow without bound
+        self.tick_store = TICK_STORE and not in_memory
+        self._ticker_ids: Dict[str, int] = {}
+        self._next_ticker_id = 1
+        self._pending: Dict[sa.Table, List[Dict[str, Any]]] = {}
+        self._pending_count = 0
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Consecutive writes that failed on a locked or busy database
+        self._failed_writes = 0
         LOG.info("[DB] Created database: %s", self.engine)
 
     async def initialize(self):
         LOG.info("[DB] Initializing database table")
         async with self.engine.begin() as conn:
             await conn.run_sync(metadata.create_all)
+            result = await conn.execute(tickers_table.select())
+            self._ticker_ids = {ticker: i for i, ticker in result.fetchall()}
+            self._next_ticker_id = max(self._ticker_ids.values(), default=0) + 1
         LOG.info("[DB] Database table initialized")
 
-    async def write_candlestick(self, c: CandleStick):
-        async with self.engine.begin() as conn:
-            stmt = history_table.insert().values(**c.json())
-            await conn.execute(stmt)
-            LOG.info("[DB] Wrote %s to history", c)
+        self._flush_requested = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop(), name="db-flush")
+
+    def persist(self, table: sa.Table, row: Dict[str, Any]):
+        """Queue a row for the next batched write"""
+        self._pending.setdefault(table, []).append(row)
+        self._pending_count += 1
+
+        if self._pending_count >= DB_FLUSH_SIZE and self._flush_requested:
+            self._flush_requested.set()
+
+    def persist_candlestick(self, c: CandleStick, table: str = history_table.name):
+        self.persist(candle_table(table), c.json())
+        LOG.info("[DB] Queued %s for %s", c, table)
+
+    def persist_tick(self, ticker: str, price: float, timestamp: Optional[float] = None):
+        if ticker not in self._ticker_ids:
+            ticker_id = self._ticker_ids[ticker] = self._next_ticker_id
+            self._next_ticker_id += 1
+            self.persist(tickers_table, {"id": ticker_id, "ticker": ticker})
+
+        t = timestamp if timestamp is not None else time()
+        self.persist(ticks_table, {"time": int(t * 1000), "ticker_id": self._ticker_ids[ticker], "price": price})
 
-    async def get_history(self, count: int = HISTORY_BUFFER) -> List[CandleStick]:
+    async def flush(self):
+        if not self._pending:
+            return
+
+        pending, count = self._pending, self._pending_count
+        self._pending, self._pending_count = {}, 0
+
+        # Shielded, a cancelled flush still writes the batch it took off the queue instead of losing it
+        await asyncio.shield(self._write(pending, count))
+
+    async def _write(self, pending: Dict[sa.Table, List[Dict[str, Any]]], count: int):
+        try:
+            async with self.engine.begin() as conn:
+                for table, rows in pending.items():
+                    await conn.execute(insert(table), rows)
+        except sa.exc.OperationalError as e:
+            # Locked or busy database, keep the rows for the next attempt unless it keeps failing
+            self._failed_writes += 1
+            if self._failed_writes >= DB_WRITE_ATTEMPTS:
+                # Ticker ids are only handed out once, the ticks queued after them must not refer to missing rows
+                tickers = pending.pop(tickers_table, [])
+                dropped = count - len(tickers)
+                LOG.error("[DB] Dropping %d rows after %d failed writes: %s", dropped, self._failed_writes, e)
+                self._failed_writes = 0
+                if tickers:
+                    self._requeue({tickers_table: tickers}, len(tickers))
+                return
+            self._requeue(pending, count)
+            raise
+        except Exception as e:
+            # Some row can never be written, retrying the batch would block every write after it
+            LOG.warning("[DB] Failed to write %d rows, writing them one by one: %s", count, e)
+            await self._write_rows(pending)
+            return
+
+        self._failed_writes = 0
+        LOG.debug("[DB] Flushed %d rows", count)
+
+    async def _write_rows(self, pending: Dict[sa.Table, List[Dict[str, Any]]]):
+        """Write rows in transactions of their own, dropping those that fail for other reasons than a busy database"""
+        retry: Dict[sa.Table, List[Dict[str, Any]]] = {}
+        for table, rows in pending.items():
+            for row in rows:
+                try:
+                    async with self.engine.begin() as conn:
+                        await conn.execute(insert(table), [row])
+                except sa.exc.OperationalError:
+                    retry.setdefault(table, []).append(row)
+                except Exception as e:
+                    LOG.error("[DB] Dropping row %s of %s: %s", row, table.name, e)
+                    if table is tickers_table:
+                        # Allocated again with the next tick, instead of recording ticks for an id never stored
+                        self._ticker_ids.pop(row["ticker"], None)
+
+        if retry:
+            self._requeue(retry, sum(len(rows) for rows in retry.values()))
+
+    def _requeue(self, pending: Dict[sa.Table, List[Dict[str, Any]]], count: int):
+        # Ahead of anything queued in the meantime
+        for table, rows in pending.items():
+            self._pending[table] = rows + self._pending.get(table, [])
+        self._pending_count += count
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), DB_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                LOG.error("[DB] Failed to flush %d queued rows: %s", self._pending_count, e)
+
+    async def get_history(self, count: int = HISTORY_BUFFER, table: str = history_table.name) -> List[CandleStick]:
+        candles = candle_table(table)
         async with self.engine.begin() as conn:
-            stmt = history_table.select().order_by(-history_table.c.time).limit(count)
+            stmt = candles.select().order_by(-candles.c.time).limit(count)
             result = await conn.execute(stmt)
             return sorted([CandleStick.create_from_db(*c) for c in result.fetchall()], key=lambda c: c.time)
 
+    async def get_ticks(self, ticker: str, start: datetime, end: datetime) -> List[Tuple[datetime, float]]:
+        if ticker not in self._ticker_ids:
+            return []
+
+        # Range reads include anything still waiting in the write queue
+        await self.flush()
+
+        async with self.engine.begin() as conn:
+            tc = ticks_table.c
+            stmt = (
+                sa.select(tc.time, tc.price)
+                .where(tc.ticker_id == self._ticker_ids[ticker])
+                .where(tc.time.between(int(start.timestamp() * 1000), int(end.timestamp() * 1000)))
+                .order_by(tc.time)
+            )
+            result = await conn.execute(stmt)
+            return [(datetime.fromtimestamp(t / 1000, TZ), price) for t, price in result.fetchall()]
+
+    async def get_candles(
+        self, ticker: str, start: datetime, end: datetime, resolution: Resolution = Resolution.HOUR
+    ) -> List[CandleStick]:
+        """Rebuild candlesticks for a single instrument from the tick store"""
+        series = CandleSeries(resolution, RESOLUTIONS[resolution][0], None)
+        for t, price in await self.get_ticks(ticker, start, end):
+            series.tick(price, t)
+
+        return list(series.candles)
+
     async def stop(self):
+        # Let the flusher finish its current batch instead of cancelling it mid-transaction
+        if self._flusher:
+            self._stopping = True
+            self._flush_requested.set()
+            await self._flusher
+            self._flusher = None
+
+        LOG.info("[DB] Flushing %d queued rows", self._pending_count)
+        try:
+            await self.flush()
+        except Exception as e:
+            LOG.error("[DB] Failed to flush queued rows on shutdown: %s", e)
+            LOG.exception(e)
+
         LOG.info("[DB] Disposing database engine")
         await self.engine.dispose()
         LOG.info("[DB] Database engine disposed")
@@ -1,22 +1,45 @@
 """Events"""
 
+import asyncio
+from collections import OrderedDict
 from enum import Enum
-from typing import Any, Dict, Coroutine, NamedTuple, Optional
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, Dict, Coroutine, Optional, Set, Tuple
+
+from . import config as c
+
+if TYPE_CHECKING:
+    from .bus import EventBus
+    from .task import Task
+
+LOG = getLogger(__name__)
 
 
 class EventType(Enum):
     STATUS: str = "status"
     PORTFOLIO: str = "portfolio"
+    PORTFOLIO_DELTA: str = "portfolio_delta"
     TICKER: str = "ticker"
     CHART: str = "chart"
     CHART_TICK: str = "chart_tick"
+    CHART_SERIES: str = "chart_series"
     INDEX: str = "index"
     CLOSE: str = "close"
 
 
-class Event(NamedTuple):
-    type: EventType
-    data: Optional[Any] = None
+class Event:
+    """
+    Not a named tuple, so every JSON codec encodes it through its json() method instead of as an array. The standard
+    library and msgspec encode tuples natively, without calling the default hook
+    """
+
+    __slots__ = ("type", "data", "topic")
+
+    def __init__(self, type: EventType, data: Optional[Any] = None, topic: Optional[str] = None) -> None:
+        self.type = type
+        self.data = data
+        # Bus topic the event was published to
+        self.topic = topic
 
     def json(self) -> Dict[str, Any]:
         return {"type": self.type.value, "data": self.data}
@@ -25,20 +48,121 @@ class Event(NamedTuple):
         return f"Event<{self.type.name}>(data={self.data})"
 
 
-class EventEmitter:
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._observers = {}
+class Dispatch(Enum):
+    # Await the observer before the next one, the publisher waits for all of them
+    SEQUENTIAL: str = "sequential"
+    # Schedule the observer as a task and return right away
+    CONCURRENT: str = "concurrent"
+    # Queue the event for a worker task per observer, events are handled in order
+    QUEUE: str = "queue"
+
+
+class Backpressure(Enum):
+    # Make the publisher wait for room in a full queue
+    BLOCK: str = "block"
+    # Drop the oldest queued event to make room
+    DROP_OLDEST: str = "drop_oldest"
+    # Keep only the latest queued event of every type and topic
+    COALESCE: str = "coalesce"
+
+
+class Observer:
+    """
+    Delivers events to a single callback, errors are isolated and reported back to the bus, and counted in the
+    stats of the task the subscription belongs to
+    """
+
+    def __init__(
+        self,
+        bus: "EventBus",
+        cb: Coroutine,
+        dispatch: Dispatch = Dispatch.SEQUENTIAL,
+        backpressure: Backpressure = Backpressure.BLOCK,
+        maxsize: int = c.EVENT_QUEUE_SIZE,
+        task: Optional["Task"] = None,
+    ) -> None:
+        self.bus = bus
+        self.cb = cb
+        self.task = task
+        self.dispatch = dispatch
+        self.backpressure = backpressure
+        self.maxsize = maxsize
+        self.dropped = 0
+        # Queued events, keyed by event type and topic when coalescing and by a running number otherwise
+        self._queue: Dict[Any, Event] = OrderedDict()
+        self._counter = 0
+        self._ready: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
 
-    async def emit(self, e: EventType, payload: Optional[Any] = None):
-        if e in self._observers:
-            event = Event(e, payload)
-            for cb in self._observers[e]:
-                await cb(event)
+    @property
+    def options(self) -> Tuple[Dispatch, Backpressure, int]:
+        return self.dispatch, self.backpressure, self.maxsize
 
-    def on(self, e: EventType, cb: Coroutine):
-        self._observers.setdefault(e, set()).add(cb)
+    async def deliver(self, event: Event):
+        if self.dispatch == Dispatch.SEQUENTIAL:
+            await self._call(event)
+        elif self.dispatch == Dispatch.CONCURRENT:
+            task = asyncio.create_task(self._call(event))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            await self._enqueue(event)
 
-    def off(self, e: EventType, cb: Coroutine):
-        if e in self._observers:
-            self._observers[e].remove(cb)
+    async def _enqueue(self, event: Event):
+        if self._worker is None:
+            self._ready, self._space = asyncio.Event(), asyncio.Event()
+            self._worker = asyncio.create_task(self._work())
+
+        if self.backpressure == Backpressure.COALESCE:
+            self._queue[event.type, event.topic] = event
+        else:
+            while len(self._queue) >= self.maxsize:
+                if self.backpressure == Backpressure.DROP_OLDEST:
+                    self._queue.popitem(last=False)
+                    self.dropped += 1
+                    if self.dropped % self.maxsize == 1:
+                        LOG.warning("%s is lagging behind, dropped %d events", self, self.dropped)
+                else:
+                    self._space.clear()
+                    await self._space.wait()
+            self._counter += 1
+            self._queue[self._counter] = event
+
+        self._ready.set()
+
+    async def _work(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+
+            while self._queue:
+                _, event = self._queue.popitem(last=False)
+                self._space.set()
+                await self._call(event)
+
+    async def _call(self, event: Event):
+        try:
+            await self.cb(event)
+        except Exception as e:
+            if self.task is not None:
+                self.task.stats.errors += 1
+            self.bus.observer_error(event, self.cb, e)
+
+    async def stop(self):
+        for task in (self._worker, *self._tasks):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._worker = None
+        self._tasks.clear()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def __repr__(self) -> str:
+        return f"Observer<{getattr(self.cb, '__qualname__', self.cb)}>({self.dispatch.value}, queued={len(self)})"
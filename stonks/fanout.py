@@ -0,0 +1,297 @@
+"""Fan-out processes"""
+
+from argparse import Namespace
+import asyncio
+from logging import getLogger
+import struct
+from typing import Dict, List, Optional, Tuple
+from weakref import WeakValueDictionary
+
+import aiohttp
+from aiohttp import web
+
+from . import config as c
+from .clients import Client, Frame
+from .events import EventType
+from .serialize import TextFrame, serialize
+from .server import Dashboard, dashboard_app
+from .snapshots import Snapshot
+from .task import Task
+
+LOG = getLogger(__name__)
+
+# Message kinds sent by the primary
+EVENT = 1  # broadcast to clients
+SNAPSHOT = 2  # refreshes a cached snapshot only
+RESPONSE = 3  # reply to a request forwarded by a fan-out
+
+EVENT_TYPES = list(EventType)
+EVENT_INDEX = {t: i for i, t in enumerate(EVENT_TYPES)}
+
+# Kind, event type, snapshot version or request id, portfolio sequence number, size of the bus topic and of the JSON
+# frame. Followed by the topic, the JSON frame, and the binary frame for events that have one. Portfolio deltas carry
+# their sequence number and portfolio snapshots the one of the latest delta they include, so fan-outs never have to
+# parse a snapshot to tell which deltas it covers.
+message = struct.Struct("<BBIIHI")
+
+# Events new clients are sent the latest of, everything else is either in the snapshots or only news once
+LATEST = (EventType.INDEX, EventType.CHART_TICK, EventType.STATUS)
+
+# JSON and binary frame of an event
+Frames = Tuple[TextFrame, Optional[bytes]]
+
+
+def encode_message(
+    kind: int,
+    event_type: EventType,
+    json: bytes,
+    binary: Optional[bytes] = None,
+    ref: int = 0,
+    seq: int = 0,
+    topic: Optional[str] = None,
+) -> bytes:
+    key = topic.encode() if topic else b""
+    return message.pack(kind, EVENT_INDEX[event_type], ref, seq, len(key), len(json)) + key + json + (binary or b"")
+
+
+def decode_message(data: bytes) -> Tuple[int, EventType, int, int, Optional[str], Frames]:
+    kind, event_type, ref, seq, topic_size, size = message.unpack_from(data)
+    start = message.size + topic_size
+    end = start + size
+    topic = data[message.size : start].decode() or None
+    binary = data[end:] or None
+
+    return kind, EVENT_TYPES[event_type], ref, seq, topic, (TextFrame(data[start:end]), binary)
+
+
+class Relay:
+    """
+    Connection from the primary to a fan-out process. Unlike dashboard clients nothing is ever dropped, a fan-out
+    falling too far behind is disconnected instead, and starts over from fresh snapshots when it reconnects.
+    """
+
+    def __init__(self, ws: web.WebSocketResponse, remote: Optional[str] = None) -> None:
+        self.ws = ws
+        self.remote = remote or "local"
+        self.queue: asyncio.Queue = asyncio.Queue(c.FANOUT_QUEUE_SIZE)
+        self._sender: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._sender = asyncio.create_task(self._send_loop(), name=f"relay-{self.remote}")
+
+    def send(self, data: bytes):
+        if self.ws.closed or self._sender is None or self._sender.done():
+            return
+
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            LOG.warning("[Relay] Fan-out %s fell %d messages behind, disconnecting", self.remote, self.queue.qsize())
+            self._sender.cancel()
+            asyncio.create_task(self.ws.close())
+
+    async def _send_loop(self):
+        try:
+            while not self.ws.closed:
+                await self.ws.send_bytes(await self.queue.get())
+        except ConnectionResetError as e:
+            LOG.info("[Relay] Fan-out %s went away: %s", self.remote, e)
+            await self.ws.close()
+        except Exception as e:
+            # Closing makes the fan-out reconnect and start over from fresh snapshots, instead of going stale
+            LOG.error("[Relay] Failed to send to fan-out %s: %s", self.remote, e)
+            await self.ws.close()
+
+    async def stop(self):
+        if self._sender:
+            self._sender.cancel()
+            try:
+                await self._sender
+            except asyncio.CancelledError:
+                pass
+            self._sender = None
+        await self.ws.close()
+
+    def __repr__(self) -> str:
+        return f"Relay<{self.remote}>(queued={self.queue.qsize()})"
+
+
+class RelayedSnapshot(Snapshot):
+    """Snapshot frame as received from the primary, None until the first one has arrived"""
+
+    def __init__(self, event_type: EventType) -> None:
+        super().__init__(event_type, lambda: None, lambda: 0)
+
+    def update(self, frame: TextFrame, version: int):
+        self._frame = frame
+        self._gzipped = None
+        self.version = version
+        self.builds += 1
+
+    def clear(self):
+        self._frame = None
+        self._gzipped = None
+        self.version = None
+
+    def frame(self) -> Optional[TextFrame]:
+        if self._frame is not None:
+            self.hits += 1
+        return self._frame
+
+
+class Upstream(Task):
+    """Connection of a fan-out process to the event stream of the primary, reconnected like any other task"""
+
+    def __init__(self, fanout: "FanOut", socket: str, path: str = "/upstream") -> None:
+        super().__init__(name="Upstream")
+        self.fanout = fanout
+        self.socket = socket
+        self.path = path
+        self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
+
+    async def run(self):
+        async with aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=self.socket)) as session:
+            # Snapshots of large portfolios easily exceed the default message size limit
+            self.ws = await session.ws_connect(f"http://primary{self.path}", max_msg_size=0)
+            LOG.info("[%s] Connected to primary on %s%s", self.name, self.socket, self.path)
+
+            try:
+                async for msg in self.ws:
+                    if msg.type == aiohttp.WSMsgType.BINARY:
+                        self.stats.messages += 1
+                        self.fanout.receive(msg.data)
+                    elif msg.type == aiohttp.WSMsgType.ERROR:
+                        LOG.error("[%s] Connection failed: %s", self.name, self.ws.exception())
+                        self.stats.errors += 1
+            finally:
+                self.ws = None
+                self.fanout.reset()
+
+        LOG.warning("[%s] Disconnected from primary", self.name)
+
+    async def send_str(self, data: str) -> bool:
+        if self.ws is None or self.ws.closed:
+            return False
+
+        await self.ws.send_str(data)
+        return True
+
+    async def stop(self):
+        LOG.info("[%s] Stopping...", self.name)
+        self.restart = False
+        if self.ws:
+            await self.ws.close()
+        LOG.info("[%s] Stopped", self.name)
+
+
+class FanOut(Dashboard):
+    """
+    Stateless dashboard server relaying the event stream of a primary process to its own clients. The primary only
+    ever encodes an event once for all fan-outs, and never touches a client socket. Fan-outs cache the snapshots,
+    the portfolio deltas since and the latest index, chart tick and status, so connecting clients are served the
+    full state without asking the primary. Run as many as needed on the same port, the kernel balances new
+    connections between them. A fan-out serves one portfolio of the primary, the default one unless told otherwise.
+    """
+
+    def __init__(self, args: Namespace) -> None:
+        # Served at the same paths as on the primary, so dashboards linking to a named portfolio work either way
+        super().__init__(dashboard_app(), ("", f"/{args.portfolio}") if args.portfolio else ("",))
+        self.port: int = args.port
+        self.snapshots = {t: RelayedSnapshot(t) for t in (EventType.PORTFOLIO, EventType.CHART)}
+        # Portfolio deltas with their sequence number, and the sequence number of the cached portfolio snapshot
+        self.deltas: List[Tuple[int, Frames]] = []
+        self.seq = 0
+        self.latest: Dict[EventType, Frames] = {}
+        # Clients waiting for a reply to a request forwarded to the primary
+        self.requests: WeakValueDictionary = WeakValueDictionary()
+        self._next_request = 0
+        self.upstream = Upstream(self, args.socket, f"/upstream/{args.portfolio}" if args.portfolio else "/upstream")
+        self._task: Optional[asyncio.Task] = None
+
+        self.app.on_startup.append(self.on_startup)
+        self.app.on_shutdown.append(self.on_shutdown)
+
+    def run(self):
+        LOG.info("Starting Stonks fan-out on port %d", self.port)
+        web.run_app(self.app, port=self.port, reuse_port=True)
+
+    def receive(self, data: bytes):
+        kind, event_type, ref, seq, topic, frames = decode_message(data)
+        json, binary = frames
+
+        if kind == RESPONSE:
+            client = self.requests.pop(ref, None)
+            if client is not None and json:
+                client.send(json)
+            return
+
+        snapshot = self.snapshots.get(event_type)
+        if snapshot is not None:
+            # The first snapshot after connecting is news to clients, later refreshes are not
+            if snapshot.version is None:
+                kind = EVENT
+            snapshot.update(json, ref)
+            if event_type == EventType.PORTFOLIO:
+                # Snapshots are not queued behind events on the primary and may overtake older deltas, only keep the
+                # deltas the snapshot doesn't cover
+                self.seq = seq
+                self.deltas = [d for d in self.deltas if d[0] > self.seq]
+        elif event_type == EventType.PORTFOLIO_DELTA:
+            if seq > self.seq:
+                self.deltas.append((seq, frames))
+        elif event_type in LATEST:
+            self.latest[event_type] = frames
+
+        if kind == EVENT:
+            self.fan_out(event_type, lambda b: binary if b and binary is not None else json, topic)
+
+    def reset(self):
+        for snapshot in self.snapshots.values():
+            snapshot.clear()
+        self.deltas = []
+        self.seq = 0
+        self.latest = {}
+
+    @staticmethod
+    def select(client: Client, frames: Frames) -> Frame:
+        json, binary = frames
+        return binary if client.binary and binary is not None else json
+
+    def welcome(self, client: Client):
+        super().welcome(client)
+        for event_type, frames in self.latest.items():
+            client.send(self.select(client, frames), event_type)
+
+    def resync(self, client: Client):
+        """Cached snapshot, followed by the deltas since, clients skip any deltas the snapshot already covers"""
+        if self.snapshots[EventType.PORTFOLIO].version is None:
+            return
+
+        super().resync(client)
+        for _, frames in self.deltas:
+            client.send(self.select(client, frames))
+
+    def send_chart(self, client: Client, request: dict):
+        self._next_request += 1
+        self.requests[self._next_request] = client
+        data = serialize({"id": self._next_request, "request": request})
+        asyncio.create_task(self.forward(data))
+
+    async def forward(self, data: str):
+        if not await self.upstream.send_str(data):
+            LOG.warning("[WS] Not connected to primary, dropping request %s", data)
+
+    async def on_startup(self, app):
+        self._task = asyncio.create_task(self.upstream.start(), name=self.upstream.name)
+
+    async def on_shutdown(self, app):
+        LOG.info("Stopping Stonks fan-out")
+        await self.upstream.stop()
+        await self.close_clients()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        LOG.info("Stonks fan-out stopped")
@@ -1,34 +1,53 @@
 from asyncio import sleep
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
 from logging import getLogger
-from typing import Any, Dict, List, Optional
+from math import ceil
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from dateutil.relativedelta import relativedelta
 
 from . import config as c
+from .bus import EventBus
 from .events import EventType
 from .task import Task
 
 LOG = getLogger(__name__)
 
 
-def get_next_close(d: Optional[datetime] = None):
+def get_next_close(d: Optional[datetime] = None, interval: relativedelta = c.CLOSE_INTERVAL):
     if not d:
         d = datetime.now(c.TZ)
 
-    return d + c.CLOSE_INTERVAL
+    return d + interval
 
 
-class CandleStick:
-    def __init__(self, _time: datetime, _open: int, _high: int, _low: int, _close: int):
-        def vt(f, t, n):
-            if not isinstance(f, t):
-                raise TypeError(f"Argument '{n}' must be type {t}, got {type(f)}")
+def downsample(candles: List["CandleStick"], points: int) -> List["CandleStick"]:
+    """Merge consecutive candlesticks so that at most N remain, keeping open, close and extremes intact"""
+    if points <= 0 or len(candles) <= points:
+        return candles
+
+    size = ceil(len(candles) / points)
+    merged = []
+    for i in range(0, len(candles), size):
+        group = candles[i : i + size]
+        merged.append(
+            CandleStick(
+                group[-1].time,
+                group[0].open,
+                max(g.high for g in group),
+                min(g.low for g in group),
+                group[-1].close,
+            )
+        )
 
-        vt(_time, datetime, "_time")
-        vt(_open, int, "_open")
-        vt(_high, int, "_high")
-        vt(_low, int, "_low")
-        vt(_close, int, "_close")
+    return merged
+
+
+class CandleStick:
+    __slots__ = ("time", "open", "high", "low", "close")
 
+    def __init__(self, _time: datetime, _open: int, _high: int, _low: int, _close: int):
         self.time = _time
         self.open = _open
         self.high = _high
@@ -60,20 +79,95 @@ class CandleStick:
 
     @classmethod
     def create_from_db(cls, _time: int, *args):
-        return cls(datetime.fromtimestamp(_time, c.TZ), *args)
+        return cls.validated(datetime.fromtimestamp(_time, c.TZ), *args)
+
+    @classmethod
+    def validated(cls, _time: datetime, _open: int, _high: int, _low: int, _close: int):
+        """Type checked constructor for candlesticks from untrusted sources, the hot path skips validation"""
+        for name, value, t in (
+            ("_time", _time, datetime),
+            ("_open", _open, int),
+            ("_high", _high, int),
+            ("_low", _low, int),
+            ("_close", _close, int),
+        ):
+            if not isinstance(value, t):
+                raise TypeError(f"Argument '{name}' must be type {t}, got {type(value)}")
+
+        return cls(_time, _open, _high, _low, _close)
 
     def __repr__(self):
         return f"CandleStick<{self.time}>[open={self.open} high={self.high} low={self.low} close={self.close}]"
 
 
+class CandleSeries:
+    """Candlesticks at a single resolution, each candlestick is timestamped with the end of its bucket"""
+
+    def __init__(self, resolution: c.Resolution, interval: relativedelta, capacity: Optional[int]):
+        self.resolution = resolution
+        self.interval = interval
+        self.candles: Deque[CandleStick] = deque(maxlen=capacity)
+
+    def tick(self, nav: int, now: datetime):
+        active = self.candles[-1] if self.candles else None
+
+        if active is None or now >= active.time:
+            last = nav if active is None else active.close
+            end = get_next_close(now, self.interval)
+            self.candles.append(CandleStick(end, last, max(last, nav), min(last, nav), nav))
+        else:
+            active.tick(nav)
+
+    def merge(self, candle: CandleStick):
+        """Fold a candlestick of equal or finer resolution into this series"""
+        end = get_next_close(candle.time - timedelta(microseconds=1), self.interval)
+        active = self.candles[-1] if self.candles else None
+
+        if active is not None and active.time == end:
+            active.high = max(active.high, candle.high)
+            active.low = min(active.low, candle.low)
+            active.close = candle.close
+        else:
+            self.candles.append(CandleStick(end, candle.open, candle.high, candle.low, candle.close))
+
+    def query(
+        self, start: Optional[datetime] = None, end: Optional[datetime] = None, points: int = c.CHART_MAX_POINTS
+    ) -> List[CandleStick]:
+        candles = [
+            candle
+            for candle in self.candles
+            if (start is None or candle.time >= start) and (end is None or candle.time <= end)
+        ]
+        return downsample(candles, points)
+
+    def __len__(self) -> int:
+        return len(self.candles)
+
+
 class History(Task):
-    def __init__(self) -> None:
+    # Resolutions that can be rebuilt from persisted hourly candlesticks
+    SEEDED = (c.Resolution.HOUR, c.Resolution.DAY, c.Resolution.WEEK)
+
+    def __init__(self, bus: Optional[EventBus] = None) -> None:
         super().__init__("Portfolio history")
-        self.history: List[CandleStick] = []
+        self.bus = bus or EventBus()
+        # Fixed capacity ring buffer, appending to a full buffer evicts the oldest candlestick
+        self.history: Deque[CandleStick] = deque(maxlen=c.HISTORY_BUFFER)
+        self.series: Dict[c.Resolution, CandleSeries] = {r: CandleSeries(r, *v) for r, v in c.RESOLUTIONS.items()}
         self.active = None
-
-    def set_history(self, history: List[CandleStick]):
-        self.history = history[-c.HISTORY_BUFFER:]
+        # Bumped on every change, cached snapshots of the history are rebuilt when it moves
+        self.version = 0
+
+    def set_history(self, history: Iterable[CandleStick]):
+        self.version += 1
+        self.history = deque(maxlen=c.HISTORY_BUFFER)
+        # Seeded from scratch, history loaded again after a restart would otherwise be merged into newer candles
+        for r in self.SEEDED:
+            self.series[r] = CandleSeries(r, *c.RESOLUTIONS[r])
+        for candle in history:
+            self.history.append(candle)
+            for r in self.SEEDED:
+                self.series[r].merge(candle)
         if self.history:
             self.active = CandleStick.create(self.history[-1].close)
             LOG.info("[%s] Initialized active candlestick from history %s", self.name, self.active)
@@ -81,6 +175,7 @@ class History(Task):
             LOG.debug("[%s] No candlestick initialized, empty history", self.name)
 
     async def tick(self, nav: int):
+        self.version += 1
         if self.active:
             self.active.tick(nav)
         else:
@@ -88,21 +183,23 @@ class History(Task):
             self.history.append(self.active)
             LOG.info("[%s] Initialized first candlestick %s", self.name, self.active)
 
-        await self.emit(EventType.CHART_TICK, self.active.json())
+        now = datetime.now(c.TZ)
+        for series in self.series.values():
+            series.tick(nav, now)
+
+        await self.bus.publish("chart.tick", EventType.CHART_TICK, self.active.json)
 
     async def close(self):
         if not self.active:
             LOG.debug("[%s] No active candlestick, close has no effect", self.name)
             return
 
-        await self.emit(EventType.CLOSE, self.active)
+        await self.bus.publish("chart.close", EventType.CLOSE, self.active)
         self.active = self.active.next()
         self.history.append(self.active)
+        self.version += 1
 
-        if len(self.history) > c.HISTORY_BUFFER:
-            self.history = self.history[-c.HISTORY_BUFFER:]
-
-        await self.emit(EventType.CHART, self.json())
+        await self.bus.publish("chart.history", EventType.CHART, self.json)
 
     async def run(self):
         self.running = True
@@ -124,6 +221,16 @@ class History(Task):
         self.running = False
         LOG.info("[%s] Stopped", self.name)
 
+    def query(
+        self,
+        resolution: c.Resolution,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        points: int = c.CHART_MAX_POINTS,
+    ) -> List[CandleStick]:
+        # Clamped, so a client asking for zero or negative points can't skip the cap on the full series
+        return self.series[resolution].query(start, end, max(1, min(points, c.CHART_MAX_POINTS)))
+
     def json(self):
         return [c.json() for c in self.history]
 
@@ -0,0 +1,86 @@
+"""Worker process IPC"""
+
+from asyncio import StreamReader
+import struct
+from typing import List, Tuple
+
+from .task import TaskStats
+
+# Frame types, sent by worker processes to the core
+UPDATES = 1
+INDEX = 2
+STATS = 3
+
+# Frame types, sent by the core to worker processes as JSON
+POSITIONS = 4  # every position, sent when the worker starts
+COMMAND = 5  # a position added or removed
+
+# Little-endian fixed layouts, tickers and names are sent as a length byte followed by UTF-8
+header = struct.Struct("<BI")  # type, payload size
+batch = struct.Struct("<?I")  # initial, number of updates, each a ticker followed by the below
+price = struct.Struct("<d")  # market price
+index = struct.Struct("<ddd")  # last, change (%), 7 day change (%), followed by ticker and name
+stats = struct.Struct("<III")  # messages, errors, restarts
+
+
+def frame(frame_type: int, payload: bytes) -> bytes:
+    return header.pack(frame_type, len(payload)) + payload
+
+
+async def read_frame(reader: StreamReader) -> Tuple[int, bytes]:
+    """Next frame from the other process, raises IncompleteReadError once it has closed its end"""
+    frame_type, size = header.unpack(await reader.readexactly(header.size))
+    return frame_type, await reader.readexactly(size)
+
+
+def pack_str(s: str) -> bytes:
+    # Cut at 255 bytes without splitting a multi-byte character
+    data = s.encode()[:255].decode(errors="ignore").encode()
+    return bytes((len(data),)) + data
+
+
+def unpack_str(payload: bytes, offset: int) -> Tuple[str, int]:
+    end = offset + 1 + payload[offset]
+    return payload[offset + 1 : end].decode(), end
+
+
+def encode_updates(pairs: List[Tuple[str, float]], initial: bool = False) -> bytes:
+    payload = bytearray(batch.pack(initial, len(pairs)))
+    for ticker, market_price in pairs:
+        payload += pack_str(ticker)
+        payload += price.pack(market_price)
+
+    return frame(UPDATES, bytes(payload))
+
+
+def decode_updates(payload: bytes) -> Tuple[List[Tuple[str, float]], bool]:
+    initial, count = batch.unpack_from(payload)
+    offset = batch.size
+    pairs = []
+
+    for _ in range(count):
+        ticker, offset = unpack_str(payload, offset)
+        pairs.append((ticker, price.unpack_from(payload, offset)[0]))
+        offset += price.size
+
+    return pairs, initial
+
+
+def encode_index(ticker: str, name: str, last: float, change: float, change_7d: float) -> bytes:
+    return frame(INDEX, index.pack(last, change, change_7d) + pack_str(ticker) + pack_str(name))
+
+
+def decode_index(payload: bytes) -> Tuple[str, str, float, float, float]:
+    last, change, change_7d = index.unpack_from(payload)
+    ticker, offset = unpack_str(payload, index.size)
+    name, _ = unpack_str(payload, offset)
+
+    return ticker, name, last, change, change_7d
+
+
+def encode_stats(s: TaskStats) -> bytes:
+    return frame(STATS, stats.pack(s.messages, s.errors, s.restarts))
+
+
+def decode_stats(payload: bytes) -> Tuple[int, int, int]:
+    return stats.unpack(payload)
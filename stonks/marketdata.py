@@ -0,0 +1,126 @@
+"""Shared market data"""
+
+from logging import getLogger
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+from .db import Database
+from .portfolio import ExchangeRates, Portfolio, Position
+from .routing import Collector, Routes
+
+LOG = getLogger(__name__)
+
+
+class Holdings(Collector):
+    """Positions of one portfolio as seen by the market data, which hears about every position added or removed"""
+
+    def __init__(self, market: "MarketData", portfolio: Portfolio) -> None:
+        self.name = "MarketData"
+        self.market = market
+        self.portfolio = portfolio
+
+    def owns(self, position: Position) -> bool:
+        return True
+
+    async def routes_changed(self, added: Set[str], removed: Set[str]):
+        await self.market.holdings_changed(self.portfolio, added, removed)
+
+
+class MarketData:
+    """
+    Market data shared by the portfolios in the process. Collectors are built against the market data instead of
+    a portfolio, so every instrument is polled or subscribed to once however many portfolios hold it, and each
+    price is passed on to the portfolios holding the instrument. Forex rates go to every portfolio.
+
+    Collectors see one position per instrument, configured like in the first portfolio holding it.
+    """
+
+    def __init__(self, db: Database, portfolios: Iterable[Portfolio] = ()) -> None:
+        self.db = db
+        self.exchange_rates = ExchangeRates()
+        self.positions: Dict[str, Position] = {}
+        self.portfolios: List[Portfolio] = []
+        # Portfolios holding each instrument
+        self.holders: Dict[str, List[Portfolio]] = {}
+        self.routes = Routes(self.positions)
+
+        for portfolio in portfolios:
+            self.add_portfolio(portfolio)
+
+    def add_portfolio(self, portfolio: Portfolio):
+        """Add a portfolio, before the collectors are created"""
+        self.portfolios.append(portfolio)
+        for p in portfolio.positions.values():
+            self._hold(portfolio, p)
+        portfolio.routes.register(Holdings(self, portfolio))
+
+        LOG.info(
+            "[MarketData] %s holds %d instruments, %d in total", portfolio.name, len(portfolio.positions), len(self)
+        )
+
+    def _hold(self, portfolio: Portfolio, p: Position) -> bool:
+        """Add a holder of an instrument, True for instruments new to the market data"""
+        holders = self.holders.setdefault(p.ticker, [])
+        holders.append(portfolio)
+        if len(holders) == 1:
+            self.positions[p.ticker] = Position(**p.config(), exchange_rates=self.exchange_rates)
+            return True
+
+        return False
+
+    async def holdings_changed(self, portfolio: Portfolio, added: Set[str], removed: Set[str]):
+        for ticker in added:
+            if self._hold(portfolio, portfolio.positions[ticker]):
+                await self.routes.add(self.positions[ticker])
+            else:
+                # Already collected for another portfolio, the new holder starts out at the current price
+                await portfolio.update((ticker, self.positions[ticker].market_price))
+
+        for ticker in removed:
+            holders = self.holders.get(ticker, [])
+            if portfolio in holders:
+                holders.remove(portfolio)
+            if not holders:
+                self.holders.pop(ticker, None)
+                self.positions.pop(ticker, None)
+                await self.routes.remove(ticker)
+
+    async def update(self, pairs: Union[Tuple[str, float], List[Tuple[str, float]]], initial: bool = False):
+        if isinstance(pairs, tuple):
+            pairs = [pairs]
+
+        batches: Dict[Portfolio, List[Tuple[str, float]]] = {}
+        for ticker, market_price in pairs:
+            if ticker in self.exchange_rates:
+                self.exchange_rates[ticker].market_price = market_price
+                holders = self.portfolios
+                changed = True
+            elif ticker in self.positions:
+                # Portfolios start out at the prices in their own configs, so unchanged prices are passed on too
+                pos = self.positions[ticker]
+                changed = pos.market_price != market_price
+                pos.market_price = market_price
+                holders = self.holders[ticker]
+            else:
+                continue
+
+            # Recorded once per instrument here, instead of once per portfolio holding it
+            if self.db.tick_store and changed:
+                self.db.persist_tick(ticker, market_price)
+            for portfolio in holders:
+                batches.setdefault(portfolio, []).append((ticker, market_price))
+
+        for portfolio, batch in batches.items():
+            await portfolio.update(batch, initial=initial)
+
+    async def update_index(self, ticker: str, name: str, last: float, change: float, change_7d: float):
+        for portfolio in self.portfolios:
+            await portfolio.update_index(ticker, name, last, change, change_7d)
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self.positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __repr__(self) -> str:
+        return f"MarketData<{len(self.positions)} instruments, {len(self.portfolios)} portfolios>"
@@ -0,0 +1,229 @@
+"""Market calendars"""
+
+from datetime import date, datetime, time, timedelta
+from logging import getLogger
+from typing import Callable, Dict, FrozenSet, Iterable, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from dateutil.easter import easter
+from dateutil.relativedelta import FR, MO, TH, relativedelta
+
+from . import config as c
+
+LOG = getLogger(__name__)
+
+Session = Tuple[datetime, datetime]
+
+
+def oslo_holidays(year: int) -> Set[date]:
+    e = easter(year)
+    return {
+        date(year, 1, 1),
+        e - timedelta(days=3),  # Maundy Thursday
+        e - timedelta(days=2),  # Good Friday
+        e + timedelta(days=1),  # Easter Monday
+        date(year, 5, 1),
+        date(year, 5, 17),
+        e + timedelta(days=39),  # Ascension Day
+        e + timedelta(days=50),  # Whit Monday
+        date(year, 12, 24),
+        date(year, 12, 25),
+        date(year, 12, 26),
+        date(year, 12, 31),
+    }
+
+
+def xetra_holidays(year: int) -> Set[date]:
+    e = easter(year)
+    return {
+        date(year, 1, 1),
+        e - timedelta(days=2),  # Good Friday
+        e + timedelta(days=1),  # Easter Monday
+        date(year, 5, 1),
+        date(year, 12, 24),
+        date(year, 12, 25),
+        date(year, 12, 26),
+        date(year, 12, 31),
+    }
+
+
+def nyse_holidays(year: int) -> Set[date]:
+    def observed(d: date) -> date:
+        # Saturday holidays are observed on Friday, Sunday holidays on Monday
+        return d - timedelta(days=1) if d.weekday() == 5 else d + timedelta(days=1) if d.weekday() == 6 else d
+
+    jan, feb, may, sep, nov = (date(year, m, 1) for m in (1, 2, 5, 9, 11))
+    holidays = {
+        jan + relativedelta(weekday=MO(+3)),  # Martin Luther King Jr. Day
+        feb + relativedelta(weekday=MO(+3)),  # Washington's Birthday
+        easter(year) + relativedelta(weekday=FR(-1)),  # Good Friday
+        may + relativedelta(day=31, weekday=MO(-1)),  # Memorial Day
+        observed(date(year, 7, 4)),
+        sep + relativedelta(weekday=MO(+1)),  # Labor Day
+        nov + relativedelta(weekday=TH(+4)),  # Thanksgiving Day
+        observed(date(year, 12, 25)),
+    }
+    # New Year's Day falling on a Saturday is not observed on the last Friday of the previous year
+    if date(year, 1, 1).weekday() != 5:
+        holidays.add(observed(date(year, 1, 1)))
+    if year >= 2022:
+        holidays.add(observed(date(year, 6, 19)))  # Juneteenth
+
+    return holidays
+
+
+def forex_holidays(year: int) -> Set[date]:
+    return {date(year, 1, 1), date(year, 12, 25)}
+
+
+class Exchange:
+    """
+    Regular trading sessions of an exchange in its own time zone. A session closing at or before its opening
+    time starts on the previous calendar day, like the 24 hour forex session opening at 17:00 in New York. Polling
+    speeds up around the open and close of sessions with edges, where prices move the most.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        tz: str,
+        open: time,
+        close: time,
+        holidays: Callable[[int], Set[date]],
+        edges: bool = True,
+    ):
+        self.name = name
+        self.tz = ZoneInfo(tz)
+        self.open = open
+        self.close = close
+        self.edges = edges
+        self._holidays = holidays
+        self._holidays_by_year: Dict[int, FrozenSet[date]] = {}
+
+    def holidays(self, year: int) -> FrozenSet[date]:
+        if year not in self._holidays_by_year:
+            self._holidays_by_year[year] = frozenset(self._holidays(year))
+        return self._holidays_by_year[year]
+
+    def is_trading_day(self, d: date) -> bool:
+        return d.weekday() < 5 and d not in self.holidays(d.year)
+
+    def session(self, d: date) -> Session:
+        start = d - timedelta(days=1) if self.close <= self.open else d
+        return (
+            datetime.combine(start, self.open, tzinfo=self.tz),
+            datetime.combine(d, self.close, tzinfo=self.tz),
+        )
+
+    def next_session(self, now: Optional[datetime] = None) -> Session:
+        """The session in progress, or the next one if the exchange is closed"""
+        now = (now or datetime.now(c.TZ)).astimezone(self.tz)
+        d = now.date()
+
+        # Holidays rarely span more than a few days, two weeks covers any calendar
+        for _ in range(14):
+            if self.is_trading_day(d):
+                start, end = self.session(d)
+                if now < end:
+                    return start, end
+            d += timedelta(days=1)
+
+        raise ValueError(f"No trading session found for {self.name} after {now}")
+
+    def last_close(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        """Close of the latest session that has ended, None if there was none in the last two weeks"""
+        now = (now or datetime.now(c.TZ)).astimezone(self.tz)
+        d = now.date()
+
+        for _ in range(14):
+            if self.is_trading_day(d):
+                _, end = self.session(d)
+                if end <= now:
+                    return end
+            d -= timedelta(days=1)
+
+        return None
+
+    def is_open(self, now: Optional[datetime] = None) -> bool:
+        now = now or datetime.now(c.TZ)
+        start, _ = self.next_session(now)
+        return start <= now
+
+    def __repr__(self) -> str:
+        return f"Exchange<{self.name}>"
+
+
+EXCHANGES: Dict[str, Exchange] = {
+    e.name: e
+    for e in (
+        Exchange("OSE", "Europe/Oslo", time(9, 0), time(16, 25), oslo_holidays),
+        Exchange("XETRA", "Europe/Berlin", time(9, 0), time(17, 35), xetra_holidays),
+        Exchange("NYSE", "America/New_York", time(9, 30), time(16, 0), nyse_holidays),
+        Exchange("FOREX", "America/New_York", time(17, 0), time(17, 0), forex_holidays),
+        # Not an exchange, Norwegian mutual funds publish their NAV on Oslo business days, often well after the
+        # close. Polled at the regular interval until late in the evening, with nothing to gain around the edges
+        Exchange("FUNDS", "Europe/Oslo", time(9, 0), time(23, 0), oslo_holidays, edges=False),
+    )
+}
+
+# Ticker suffixes used by the collectors and the exchange they trade on
+SUFFIXES = {
+    "_OSE": "OSE",
+    ".OL": "OSE",
+    ".DE": "XETRA",
+    ".F": "XETRA",
+}
+
+
+def exchange_for(ticker: str, asset: c.Asset, exchange: Optional[str] = None) -> Optional[Exchange]:
+    """Resolve the exchange of an instrument, an exchange given in the portfolio config takes precedence"""
+    if exchange:
+        if exchange not in EXCHANGES:
+            raise ValueError(f"Unknown exchange {exchange!r} for {ticker}, expected one of {', '.join(EXCHANGES)}")
+        return EXCHANGES[exchange]
+    if asset in (c.Asset.CASH, c.Asset.UNLISTED_EQUITY):
+        return None
+    if asset == c.Asset.FOREX:
+        return EXCHANGES["FOREX"]
+    if asset in (c.Asset.FUND, c.Asset.INDEX_FUND):
+        return EXCHANGES["FUNDS"]
+
+    for suffix, name in SUFFIXES.items():
+        if ticker.endswith(suffix):
+            return EXCHANGES[name]
+
+    # Yahoo lists US instruments without a suffix, other suffixes are polled at a fixed interval
+    if "." in ticker or "_" in ticker:
+        return None
+    return EXCHANGES["NYSE"]
+
+
+def poll_interval(exchanges: Iterable[Optional[Exchange]], interval: float, now: Optional[datetime] = None) -> float:
+    """
+    Polling interval for instruments trading on the given exchanges. Polling speeds up around the open and close
+    of any session in progress, and slows down to the next session open while all exchanges are closed. Closing
+    prices of delayed feeds arrive after the close, so polling only slows down once MARKET_CLOSE_GRACE has passed.
+    None stands for instruments without a known exchange, which are polled at the fixed interval.
+    """
+    now = now or datetime.now(c.TZ)
+    edge = timedelta(seconds=c.MARKET_EDGE_WINDOW)
+    grace = timedelta(seconds=c.MARKET_CLOSE_GRACE)
+    intervals = []
+
+    for exchange in exchanges:
+        if exchange is None:
+            intervals.append(interval)
+            continue
+
+        start, end = exchange.next_session(now)
+        if start <= now:
+            near_edge = exchange.edges and (now - start < edge or end - now < edge)
+            intervals.append(interval / c.MARKET_EDGE_SPEEDUP if near_edge else interval)
+        elif now - (exchange.last_close(now) or now - grace) < grace:
+            intervals.append(interval)
+        else:
+            # Wake up for the open, but check in every now and then in case the calendar is off
+            until_open = (start - now).total_seconds()
+            intervals.append(max(1.0, min(until_open, max(interval, c.MARKET_CLOSED_MAX_INTERVAL))))
+
+    return min(intervals, default=interval)
@@ -2,20 +2,33 @@
 
 import asyncio
 from asyncio.tasks import sleep
-from collections import deque
+from itertools import islice
+from array import array
+from collections.abc import Mapping
 from logging import getLogger
 from json import load
 from pathlib import Path
-from typing import Dict, List, Tuple, Union
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from . import config as c
-from .db import Database
-from .events import EventEmitter, EventType, Event
+from . import protocol
+from .bus import EventBus
+from .db import Database, candle_table
+from .events import EventType, Event
 from .history import History
+from .markets import Exchange, exchange_for
+from .routing import Routes
 from .task import Task
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 LOG = getLogger(__name__)
 
+ASSETS = list(c.Asset)
+
 
 class Forex:
     def __init__(self, name: str, ticker: str, market_price: float):
@@ -32,9 +45,8 @@ class Forex:
         }
 
 
-class ExchangeRates(EventEmitter):
+class ExchangeRates:
     def __init__(self):
-        super().__init__()
         self.rates: Dict[str, Forex] = {f[0]: Forex(*f) for f in c.FOREX}
         self.rates_by_ticker: Dict[str, Forex] = {f.ticker: f for f in self.rates.values()}
 
@@ -42,8 +54,6 @@ class ExchangeRates(EventEmitter):
         if key in self:
             forex = self[key]
             forex.market_price = market_price
-
-            await self.emit(EventType.TICKER, forex.json())
         else:
             LOG.warning("Attempt to update portfolio with forex rate for %s which is not tracked", key)
 
@@ -55,6 +65,20 @@ class ExchangeRates(EventEmitter):
 
 
 class Position:
+    __slots__ = (
+        "name",
+        "ticker",
+        "volume",
+        "market_price",
+        "cost",
+        "currency",
+        "asset",
+        "exchange_rates",
+        "collector",
+        "exchange",
+        "_forex",
+    )
+
     def __init__(
         self,
         name: str,
@@ -66,6 +90,7 @@ class Position:
         asset: c.Asset,
         exchange_rates: ExchangeRates,
         collector: str = "default",
+        exchange: Optional[str] = None,
     ):
         self.name = name
         self.ticker = ticker
@@ -76,10 +101,12 @@ class Position:
         self.asset = asset
         self.exchange_rates = exchange_rates
         self.collector = collector
+        self.exchange: Optional[Exchange] = exchange_for(ticker, asset, exchange)
+        self._forex = None if currency == "NOK" else exchange_rates[currency]
 
     @property
     def market_value(self):
-        er = 1.0 if self.currency == "NOK" else self.exchange_rates[self.currency].market_price
+        er = 1.0 if self._forex is None else self._forex.market_price
 
         return round(self.volume * self.market_price * er, c.PRECISION)
 
@@ -105,42 +132,336 @@ class Position:
             "currency": self.currency,
         }
 
+    def config(self) -> Dict[str, Any]:
+        """Config entry of the position at its current market price, as taken by the constructor"""
+        return {
+            "name": self.name,
+            "ticker": self.ticker,
+            "volume": self.volume,
+            "price": self.market_price,
+            "cost": self.cost,
+            "currency": self.currency,
+            "asset": self.asset,
+            "collector": self.collector,
+            "exchange": self.exchange.name if self.exchange else None,
+        }
+
+
+class PositionRow(Position):
+    """Position view of a single row in a PositionStore. Views are cheap and only valid until rows are removed"""
+
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store: "PositionStore", row: int):
+        self._store = store
+        self._row = row
+
+    name = property(lambda self: self._store.names[self._row])
+    ticker = property(lambda self: self._store.tickers[self._row])
+    volume = property(lambda self: self._store.volume[self._row])
+    cost = property(lambda self: self._store.cost[self._row])
+    currency = property(lambda self: self._store.currencies[self._store.currency[self._row]])
+    asset = property(lambda self: self._store.assets[self._row])
+    collector = property(lambda self: self._store.collectors[self._row])
+    exchange = property(lambda self: self._store.exchanges[self._row])
+    exchange_rates = property(lambda self: self._store.exchange_rates)
+    _forex = property(lambda self: self._store.forex[self._store.currency[self._row]])
+
+    @property
+    def market_price(self) -> float:
+        return self._store.market_price[self._row]
+
+    @market_price.setter
+    def market_price(self, value: float):
+        self._store.market_price[self._row] = value
+
+
+class PositionStore(Mapping):
+    """
+    Columnar position store for large portfolios. Numeric columns are kept in contiguous arrays with a
+    ticker to row index, so portfolio wide valuation is done in bulk over the columns instead of walking
+    thousands of Position objects. Behaves like the ticker to Position dict it replaces.
+
+    The bulk operations are vectorized with numpy when it is installed, working on the arrays in place, and
+    fall back to plain loops over the columns otherwise.
+    """
+
+    def __init__(self, exchange_rates: ExchangeRates, positions: Iterable[Dict[str, Any]] = ()):
+        self.exchange_rates = exchange_rates
+        self.currencies: List[str] = ["NOK", *exchange_rates.rates]
+        self.forex: List[Optional[Forex]] = [None, *exchange_rates.rates.values()]
+        self.index: Dict[str, int] = {}
+        self.tickers: List[str] = []
+        self.names: List[str] = []
+        self.assets: List[c.Asset] = []
+        self.collectors: List[str] = []
+        self.exchanges: List[Optional[Exchange]] = []
+        self.volume = array("d")
+        self.market_price = array("d")
+        self.cost = array("d")
+        self.currency = array("B")
+        self.asset = array("B")
+
+        for p in positions:
+            self.add(**p)
+
+    def add(
+        self,
+        name: str,
+        ticker: str,
+        volume: float,
+        price: float,
+        cost: float,
+        currency: str,
+        asset: c.Asset,
+        collector: str = "default",
+        exchange: Optional[str] = None,
+    ) -> PositionRow:
+        if ticker in self.index:
+            raise KeyError(f"Position {ticker} already exists")
+        if currency not in self.currencies:
+            raise ValueError(f"Position {ticker} is in {currency}, which has no exchange rate configured in FOREX")
+
+        self.index[ticker] = len(self.tickers)
+        self.tickers.append(ticker)
+        self.names.append(name)
+        self.assets.append(asset)
+        self.collectors.append(collector)
+        self.exchanges.append(exchange_for(ticker, asset, exchange))
+        self.volume.append(volume)
+        self.market_price.append(price)
+        self.cost.append(cost)
+        self.currency.append(self.currencies.index(currency))
+        self.asset.append(ASSETS.index(asset))
+
+        return self[ticker]
+
+    def remove(self, ticker: str):
+        """Remove a position by moving the last row into its place"""
+        row = self.index.pop(ticker)
+        last = len(self.tickers) - 1
+
+        for column in (
+            self.tickers,
+            self.names,
+            self.assets,
+            self.collectors,
+            self.exchanges,
+            self.volume,
+            self.market_price,
+            self.cost,
+            self.currency,
+            self.asset,
+        ):
+            column[row] = column[last]
+            column.pop()
+
+        if row != last:
+            self.index[self.tickers[row]] = row
+
+    def rates(self) -> List[float]:
+        return [1.0 if f is None else f.market_price for f in self.forex]
+
+    def market_values(self) -> List[float]:
+        rates = self.rates()
+        if numpy is not None and self.tickers:
+            currency = numpy.frombuffer(self.currency, dtype=numpy.uint8)
+            values = numpy.frombuffer(self.volume) * numpy.frombuffer(self.market_price) * numpy.array(rates)[currency]
+            return values.tolist()
+
+        return [v * p * rates[i] for v, p, i in zip(self.volume, self.market_price, self.currency)]
+
+    def totals(self) -> Tuple[float, Dict[str, Dict[c.Asset, float]]]:
+        """Total cost, and market values per currency and asset class in the position currency"""
+        if numpy is not None and self.tickers:
+            # One bin per currency and asset class pair
+            groups = numpy.frombuffer(self.currency, dtype=numpy.uint8).astype(numpy.intp) * len(ASSETS)
+            groups += numpy.frombuffer(self.asset, dtype=numpy.uint8)
+            size = len(self.currencies) * len(ASSETS)
+            values = numpy.bincount(
+                groups, weights=numpy.frombuffer(self.volume) * numpy.frombuffer(self.market_price), minlength=size
+            )
+            assets: Dict[str, Dict[c.Asset, float]] = {}
+            for group in numpy.flatnonzero(numpy.bincount(groups, minlength=size)).tolist():
+                currency, asset = divmod(group, len(ASSETS))
+                assets.setdefault(self.currencies[currency], {})[ASSETS[asset]] = float(values[group])
+
+            return float(numpy.frombuffer(self.cost).sum()), assets
+
+        assets = {}
+        for v, p, i, asset in zip(self.volume, self.market_price, self.currency, self.assets):
+            by_asset = assets.setdefault(self.currencies[i], {})
+            by_asset[asset] = by_asset.get(asset, 0.0) + v * p
+
+        return sum(self.cost), assets
+
+    def json(self, market_value: float) -> List[Dict[str, Any]]:
+        positions = []
+        for row, value in enumerate(self.market_values()):
+            value = round(value, c.PRECISION)
+            cost = self.cost[row]
+            positions.append(
+                {
+                    "name": self.names[row],
+                    "ticker": self.tickers[row],
+                    "volume": self.volume[row],
+                    "cost": cost,
+                    "market_price": self.market_price[row],
+                    "market_value": value,
+                    "net_return": round(value - cost, c.PRECISION),
+                    "net_return_percent": round(100 * (value - cost) / cost, c.PRECISION),
+                    "asset": self.assets[row].value,
+                    "currency": self.currencies[self.currency[row]],
+                    "allocation": round(value / (market_value or 1) * 100.0, 1),
+                }
+            )
+
+        return positions
+
+    def __getitem__(self, ticker: str) -> PositionRow:
+        return PositionRow(self, self.index[ticker])
+
+    def __contains__(self, ticker) -> bool:
+        return ticker in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.tickers)
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+
+class Aggregates:
+    """
+    Running portfolio totals. Market values are kept per currency and asset class in the position currency,
+    so a price change is applied as a delta and a forex change needs no bookkeeping at all, the NOK totals
+    are derived from the handful of currency subtotals on demand. The portfolio rebuilds them from the positions
+    with every snapshot, so float rounding in the deltas never drifts far.
+    """
+
+    def __init__(self, exchange_rates: ExchangeRates):
+        self.exchange_rates = exchange_rates
+        self.cost = 0.0
+        self.subtotals: Dict[str, float] = {}
+        self.assets: Dict[str, Dict[c.Asset, float]] = {}
+
+    def add(self, p: Position):
+        self.cost += p.cost
+        self._apply(p.currency, p.asset, p.volume * p.market_price)
+
+    def remove(self, p: Position):
+        self.cost -= p.cost
+        self._apply(p.currency, p.asset, -p.volume * p.market_price)
+
+    def update(self, p: Position, previous_price: float):
+        self._apply(p.currency, p.asset, p.volume * (p.market_price - previous_price))
+
+    def rebuild(self, positions: Union[PositionStore, Iterable[Position]]):
+        self.cost = 0.0
+        self.subtotals = {}
+        self.assets = {}
+
+        if isinstance(positions, PositionStore):
+            self.cost, self.assets = positions.totals()
+            self.subtotals = {k: sum(v.values()) for k, v in self.assets.items()}
+        else:
+            for p in positions:
+                self.add(p)
+
+    def rate(self, currency: str) -> float:
+        return 1.0 if currency == "NOK" else self.exchange_rates[currency].market_price
+
+    @property
+    def market_value(self) -> float:
+        return sum(value * self.rate(currency) for currency, value in self.subtotals.items())
+
+    def composition(self, market_value: Optional[float] = None) -> Dict[str, float]:
+        if market_value is None:
+            market_value = self.market_value
+
+        composition = {}
+        for currency, assets in self.assets.items():
+            er = self.rate(currency)
+            for asset, value in assets.items():
+                composition[asset.value] = composition.get(asset.value, 0.0) + value * er
+
+        return {k: round(v / (market_value or 1) * 100.0, 1) for k, v in composition.items()}
+
+    def _apply(self, currency: str, asset: c.Asset, delta: float):
+        self.subtotals[currency] = self.subtotals.get(currency, 0.0) + delta
+        assets = self.assets.setdefault(currency, {})
+        assets[asset] = assets.get(asset, 0.0) + delta
+
 
 class Portfolio(Task):
-    def __init__(self, db: Database, positions):
-        super().__init__("Portfolio")
-        self._queue = deque([])
+    def __init__(
+        self,
+        db: Database,
+        positions,
+        columnar: Optional[bool] = None,
+        bus: Optional[EventBus] = None,
+        name: str = "Portfolio",
+        history_table: str = "history",
+        ticks: Optional[bool] = None,
+    ):
+        super().__init__(name)
+        # Latest price per ticker waiting to be processed, the processor sleeps until the wakeup is set
+        self._pending: Dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
         self.db = db
+        # Declared up front, so the database creates it along with the other tables
+        self.history_table = candle_table(history_table).name
+        # Record accepted prices in the tick store, off when shared market data records them once for all portfolios
+        self.ticks = db.tick_store if ticks is None else ticks
         self.running = False
         self.indices = {}
-        self.history = History()
+        self.bus = bus or EventBus()
+        self.history = History(self.bus)
         self.history_task = None
         self.exchange_rates = ExchangeRates()
-        self.positions = {p["ticker"]: Position(**p, exchange_rates=self.exchange_rates) for p in positions}
-        self.active_forex = {p.currency for p in self.positions.values()}
-
-        async def re_emit(e: Event):
-            await self.emit(e.type, e.data)
-
-        self.history.on(EventType.CHART, re_emit)
-        self.history.on(EventType.CHART_TICK, re_emit)
-        self.history.on(EventType.CLOSE, self.handle_close)
+        if columnar is None:
+            columnar = len(positions) >= c.COLUMNAR_STORE_THRESHOLD
+        if columnar:
+            self.positions = PositionStore(self.exchange_rates, positions)
+        else:
+            self.positions = {p["ticker"]: Position(**p, exchange_rates=self.exchange_rates) for p in positions}
+        self.routes = Routes(self.positions)
+        # Instrument ids for the binary dashboard protocol, listed in the snapshot and never reused
+        self.ids: Dict[str, int] = {}
+        for ticker in (*self.exchange_rates.rates_by_ticker, *self.positions):
+            self.ids[ticker] = len(self.ids)
+        self._next_id = len(self.ids)
+        self.aggregates = Aggregates(self.exchange_rates)
+        self.sequence = 0
+        # Bumped on every change to the portfolio state, cached snapshots are rebuilt when it moves
+        self.version = 0
+        self._dirty: Dict[str, Position] = {}
+        self._dirty_forex = set()
+        self._reindex()
+
+        self.bus.subscribe("chart.close", self.handle_close, task=self)
 
     @staticmethod
-    def from_config(config_file: Union[Path, str], db: Database) -> "Portfolio":
+    def load_config(config_file: Union[Path, str]) -> List[Dict[str, Any]]:
         with open(config_file) as f:
             data = load(f)
             for p in data["positions"]:
                 p["asset"] = c.Asset[p["asset"]]
-            return Portfolio(db, data["positions"])
+            return data["positions"]
+
+    @staticmethod
+    def from_config(
+        config_file: Union[Path, str], db: Database, bus: Optional[EventBus] = None, **kwargs
+    ) -> "Portfolio":
+        return Portfolio(db, Portfolio.load_config(config_file), bus=bus, **kwargs)
 
     @property
     def cost(self):
-        return round(sum(p.cost for p in self.positions.values()))
+        return round(self.aggregates.cost)
 
     @property
     def net_asset_value(self):
-        return round(sum(p.market_value for p in self.positions.values()))
+        return round(self.aggregates.market_value)
 
     @property
     def net_return(self):
@@ -156,11 +477,74 @@ class Portfolio(Task):
         if initial:
             await self._process(pairs, initial=True)
         else:
-            self._queue.extend(pairs)
+            for ticker, market_price in pairs:
+                self._pending[ticker] = market_price
+            if self._wakeup:
+                self._wakeup.set()
+
+    async def add_position(self, position: Dict[str, Any]) -> Position:
+        """Add a position from a config entry, the owning collectors pick it up through the routes"""
+        ticker = position["ticker"]
+        if ticker in self.positions:
+            raise KeyError(f"Position {ticker} already exists")
+
+        if isinstance(self.positions, PositionStore):
+            p = self.positions.add(**position)
+        else:
+            p = self.positions[ticker] = Position(**position, exchange_rates=self.exchange_rates)
+        self.ids[ticker] = self._next_id
+        self._next_id += 1
+        self._reindex()
+        self.version += 1
+
+        LOG.info("[%s] Added position %s", self.name, ticker)
+        await self.routes.add(p)
+        await self.bus.publish("portfolio.snapshot", EventType.PORTFOLIO, self)
+
+        return p
+
+    async def remove_position(self, ticker: str):
+        if isinstance(self.positions, PositionStore):
+            self.positions.remove(ticker)
+        else:
+            del self.positions[ticker]
+        self._pending.pop(ticker, None)
+        self.ids.pop(ticker, None)
+        # Rows may have moved in the position store, refresh the views of anything left dirty
+        self._dirty = {t: self.positions[t] for t in self._dirty if t in self.positions}
+        self._reindex()
+        self.version += 1
+
+        LOG.info("[%s] Removed position %s", self.name, ticker)
+        await self.routes.remove(ticker)
+        await self.bus.publish("portfolio.snapshot", EventType.PORTFOLIO, self)
+
+    async def reload(self, positions: List[Dict[str, Any]]):
+        """
+        Add the positions new to a reloaded config and remove those no longer in it. Positions already held keep
+        their volume and cost, change those by removing and adding the position again.
+        """
+        tickers = {p["ticker"] for p in positions}
+        for ticker in [t for t in self.positions if t not in tickers]:
+            await self.remove_position(ticker)
+        for p in positions:
+            if p["ticker"] not in self.positions:
+                await self.add_position(p)
+
+    def _reindex(self):
+        """Rebuild the totals and lookups derived from the positions after positions are added or removed"""
+        positions = list(self.positions.values())
+        self.aggregates.rebuild(self.positions if isinstance(self.positions, PositionStore) else positions)
+        self.active_forex = {p.currency for p in positions}
+        self._by_currency: Dict[str, List[Position]] = {}
+        for p in positions:
+            self._by_currency.setdefault(p.currency, []).append(p)
+        self._composition = self.aggregates.composition()
 
     async def update_index(self, ticker: str, name: str, last: float, change: float, change_7d: float):
         self.indices[ticker] = {"ticker": ticker, "name": name, "last": last, "change": change, "change_7d": change_7d}
-        await self.emit(EventType.INDEX, self.indices)
+        self.version += 1
+        await self.bus.publish(f"index.{ticker}", EventType.INDEX, self.indices)
         self.stats.messages += 1
 
     async def _process(self, pairs: List[Tuple[str, float]], initial: bool = False):
@@ -174,16 +558,26 @@ class Portfolio(Task):
                 forex = self.exchange_rates[ticker]
                 if forex.name in self.active_forex:
                     emit_portfolio = True
+                self._dirty_forex.add(forex.name)
 
                 await self.exchange_rates.update(ticker, market_price)
-                await self.emit(EventType.TICKER, forex.json())
+                self.version += 1
+                await self.bus.publish(f"ticker.{ticker}", EventType.TICKER, forex.json)
                 self.stats.messages += 1
+                if self.ticks:
+                    self.db.persist_tick(ticker, market_price)
             elif ticker in self.positions:
                 pos = self.positions[ticker]
                 if pos.market_price == market_price:
                     continue
+                previous_price = pos.market_price
                 pos.market_price = market_price
-                await self.emit(EventType.TICKER, pos.json())
+                self.aggregates.update(pos, previous_price)
+                self.version += 1
+                self._dirty[ticker] = pos
+                if self.ticks:
+                    self.db.persist_tick(ticker, market_price)
+                await self.bus.publish(f"ticker.{ticker}", EventType.TICKER, pos.json)
                 self.stats.messages += 1
                 emit_portfolio = True
 
@@ -191,66 +585,122 @@ class Portfolio(Task):
 
         # Skip adding initial updates
         if emit_portfolio and not initial:
-            await self.emit(EventType.PORTFOLIO, self.json())
+            if not await self.bus.publish("portfolio.delta", EventType.PORTFOLIO_DELTA, self.delta):
+                # Nobody is listening, start the next delta from here
+                self._dirty = {}
+                self._dirty_forex = set()
+                self._composition = self.aggregates.composition()
             await self.history.tick(self.net_asset_value)
             self.stats.messages += 1
 
     async def handle_close(self, e: Event):
-        try:
-            await self.db.write_candlestick(e.data)
-        except Exception as e:
-            LOG.error("[%s] Error handling write candlestick close: %s", self, e)
-            LOG.exception(e)
-            self.stats.errors += 1
+        self.db.persist_candlestick(e.data, self.history_table)
+
+    def delta(self) -> Dict[str, Any]:
+        """
+        Changes since the previous delta. Only positions, exchange rates and composition entries that changed
+        are included, clients detect missed deltas through the sequence number and request a full resync.
+        """
+        positions = self._dirty
+        for currency in self._dirty_forex:
+            for p in self._by_currency.get(currency, ()):
+                positions[p.ticker] = p
+
+        current = self.net_asset_value
+        cost = self.cost
+        composition = self.aggregates.composition(current)
+        # Snapshots carry the sequence number, so a new delta makes any cached snapshot stale as well
+        self.sequence += 1
+        self.version += 1
+
+        data = {
+            "seq": self.sequence,
+            "market_value": current,
+            "net_return": current - cost,
+            "net_return_percent": round(100 * (current - cost) / (cost or 1), c.PRECISION),
+            "cost": cost,
+            "positions": [p.json() for p in positions.values()],
+            "exchange_rates": {k: self.exchange_rates[k].json() for k in self._dirty_forex},
+            "composition": {k: v for k, v in composition.items() if self._composition.get(k) != v},
+        }
+
+        self._dirty = {}
+        self._dirty_forex = set()
+        self._composition = composition
+
+        return data
 
     def json(self):
+        # Snapshots visit every position anyway, rebuild the running totals so rounding errors never add up
+        self.aggregates.rebuild(
+            self.positions if isinstance(self.positions, PositionStore) else self.positions.values()
+        )
         current = self.net_asset_value
-        positions = [p.json() for p in self.positions.values()]
+        cost = self.cost
 
-        # Enrich with portfolio composition
-        composition = {}
-        for p in positions:
-            alloc = p["market_value"] / current * 100.0
-            asset = p["asset"]
-            p["allocation"] = round(alloc, 1)
-            composition[asset] = composition.get(asset, 0.0) + alloc
-        for c, val in composition.items():
-            composition[c] = round(val, 1)
+        if isinstance(self.positions, PositionStore):
+            positions = self.positions.json(current)
+            for p in positions:
+                p["id"] = self.ids[p["ticker"]]
+        else:
+            positions = [p.json() for p in self.positions.values()]
+            for p in positions:
+                p["allocation"] = round(p["market_value"] / (current or 1) * 100.0, 1)
+                p["id"] = self.ids[p["ticker"]]
+        exchange_rates = {f.name: {**f.json(), "id": self.ids[f.ticker]} for f in self.exchange_rates.rates.values()}
 
         return {
+            "seq": self.sequence,
             "market_value": current,
-            "net_return": self.net_return,
-            "net_return_percent": self.net_return_percent,
-            "cost": self.cost,
+            "net_return": current - cost,
+            "net_return_percent": round(100 * (current - cost) / (cost or 1), c.PRECISION),
+            "cost": cost,
             "positions": positions,
-            "exchange_rates": {f.name: f.json() for f in self.exchange_rates.rates.values()},
-            "composition": composition,
+            "exchange_rates": exchange_rates,
+            "composition": self.aggregates.composition(current),
             "indices": self.indices,
+            "assets": protocol.ASSETS,
         }
 
     async def run(self):
         self.running = True
-        self.history.set_history(await self.db.get_history())
+        self.history.set_history(await self.db.get_history(c.RESOLUTIONS[c.Resolution.HOUR][1], self.history_table))
         self.history_task = asyncio.create_task(self.history.start())
 
-        while self.running:
-            tickers = set()
-            latest = []
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
 
-            while self._queue:
-                item = self._queue.pop()
-                t = item[0]
-                if t not in tickers:
-                    tickers.add(t)
-                    latest.append(item)
+        while self.running:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self.running:
+                break
+
+            await self._process(self._take_batch())
+
+            # Carry over what did not fit in the batch, and let further updates coalesce for a while
+            if self._pending:
+                self._wakeup.set()
+            await sleep(c.PROCESSING_MIN_INTERVAL)
+
+    def _take_batch(self) -> List[Tuple[str, float]]:
+        if len(self._pending) <= c.PROCESSING_MAX_BATCH:
+            batch = list(self._pending.items())
+            self._pending = {}
+        else:
+            batch = list(islice(self._pending.items(), c.PROCESSING_MAX_BATCH))
+            for ticker, _ in batch:
+                del self._pending[ticker]
 
-            await self._process(latest)
-            await sleep(c.PROCESSING_INTERVAL)
+        return batch
 
     async def stop(self):
         LOG.info("[%s] Stopping...", self.name)
         self.restart = False
         self.running = False
+        if self._wakeup:
+            self._wakeup.set()
         await self.history.stop()
         LOG.info("[%s] Stopped", self.name)
 
@@ -0,0 +1,77 @@
+"""Binary dashboard protocol"""
+
+from logging import getLogger
+import struct
+from typing import Any, Dict, Optional
+
+from .config import Asset
+from .events import Event, EventType
+
+LOG = getLogger(__name__)
+
+# Frame types, the first byte of every binary frame
+TICKER = 1
+CHART_TICK = 2
+PORTFOLIO_DELTA = 3
+
+# Composition entries are sent as indexes into the asset classes, listed in the portfolio snapshot
+ASSETS = [a.value for a in Asset]
+ASSET_INDEX = {a: i for i, a in enumerate(ASSETS)}
+
+# Little-endian fixed layouts, instruments are referred to by the ids listed in the portfolio snapshot
+ticker_frame = struct.Struct("<BHdd")  # type, id, market price, market value (NaN for forex)
+candle_frame = struct.Struct("<BIdddd")  # type, time, open, high, low, close
+delta_frame = struct.Struct("<BIddddHHB")  # type, seq, market value, net return (%), cost, counts of the below
+delta_position = struct.Struct("<Hdd")  # id, market price, market value
+delta_forex = struct.Struct("<Hd")  # id, market price
+delta_composition = struct.Struct("<Bd")  # asset index, allocation
+
+
+def encode(e: Event, ids: Dict[str, int]) -> Optional[bytes]:
+    """
+    Compact binary frame for the high rate events, or None if the event has no binary form and should be sent as
+    JSON. Ids are the instrument ids assigned by the portfolio.
+    """
+    try:
+        if e.type == EventType.TICKER:
+            return encode_ticker(e.data, ids)
+        elif e.type == EventType.CHART_TICK:
+            return candle_frame.pack(
+                CHART_TICK, e.data["time"], e.data["open"], e.data["high"], e.data["low"], e.data["close"]
+            )
+        elif e.type == EventType.PORTFOLIO_DELTA:
+            return encode_delta(e.data, ids)
+    except (KeyError, struct.error) as err:
+        LOG.debug("Sending %s as JSON, no binary encoding: %s", e.type, err)
+
+    return None
+
+
+def encode_ticker(data: Dict[str, Any], ids: Dict[str, int]) -> bytes:
+    return ticker_frame.pack(TICKER, ids[data["ticker"]], data["market_price"], data.get("market_value", float("nan")))
+
+
+def encode_delta(data: Dict[str, Any], ids: Dict[str, int]) -> bytes:
+    positions, forex, composition = data["positions"], data["exchange_rates"].values(), data["composition"]
+    frame = bytearray(
+        delta_frame.pack(
+            PORTFOLIO_DELTA,
+            data["seq"],
+            data["market_value"],
+            data["net_return"],
+            data["net_return_percent"],
+            data["cost"],
+            len(positions),
+            len(forex),
+            len(composition),
+        )
+    )
+
+    for p in positions:
+        frame += delta_position.pack(ids[p["ticker"]], p["market_price"], p["market_value"])
+    for f in forex:
+        frame += delta_forex.pack(ids[f["ticker"]], f["market_price"])
+    for asset, allocation in composition.items():
+        frame += delta_composition.pack(ASSET_INDEX[asset], allocation)
+
+    return bytes(frame)
@@ -0,0 +1,69 @@
+"""Ticker routing"""
+
+from logging import getLogger
+from typing import TYPE_CHECKING, Dict, Mapping, Set
+
+if TYPE_CHECKING:
+    from .portfolio import Position
+
+LOG = getLogger(__name__)
+
+
+class Collector:
+    """Collectors declare which positions they own, and are told when their slice of the portfolio changes"""
+
+    name: str
+
+    def owns(self, position: "Position") -> bool:
+        return False
+
+    async def routes_changed(self, added: Set[str], removed: Set[str]):
+        pass
+
+
+class Routes:
+    """
+    Routing index between portfolio positions and the collectors owning them. Ticker sets per collector and the
+    owners per ticker are built when collectors register and kept up to date as positions are added and removed,
+    so collectors only ever look at their own slice instead of scanning the whole portfolio.
+    """
+
+    def __init__(self, positions: Mapping[str, "Position"]) -> None:
+        self.positions = positions
+        self.collectors: Dict[str, Collector] = {}
+        self.by_collector: Dict[str, Set[str]] = {}
+        self.by_ticker: Dict[str, Set[str]] = {}
+
+    def register(self, collector: Collector) -> Set[str]:
+        self.collectors[collector.name] = collector
+        tickers = self.by_collector.setdefault(collector.name, set())
+
+        for p in self.positions.values():
+            if collector.owns(p):
+                tickers.add(p.ticker)
+                self.by_ticker.setdefault(p.ticker, set()).add(collector.name)
+
+        LOG.info("[Routes] %s owns %d instruments", collector.name, len(tickers))
+        return tickers
+
+    def owners(self, ticker: str) -> Set[str]:
+        return self.by_ticker.get(ticker, set())
+
+    async def add(self, position: "Position"):
+        for name, collector in self.collectors.items():
+            if collector.owns(position):
+                self.by_collector[name].add(position.ticker)
+                self.by_ticker.setdefault(position.ticker, set()).add(name)
+                await collector.routes_changed({position.ticker}, set())
+
+    async def remove(self, ticker: str):
+        for name in self.by_ticker.pop(ticker, ()):
+            self.by_collector[name].discard(ticker)
+            await self.collectors[name].routes_changed(set(), {ticker})
+
+    def __getitem__(self, name: str) -> Set[str]:
+        """Tickers owned by a collector, the set is updated in place as routes change"""
+        return self.by_collector.setdefault(name, set())
+
+    def __repr__(self) -> str:
+        return f"Routes<{', '.join(f'{k}={len(v)}' for k, v in self.by_collector.items())}>"
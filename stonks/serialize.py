@@ -1,24 +1,106 @@
 """Custom serializer"""
 
 from datetime import date, datetime
-from functools import partial
-from json import JSONEncoder, dumps
+from json import JSONEncoder, dumps, loads
+from logging import getLogger
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
 
+from . import config as c
 from .events import Event, EventType
 from .history import CandleStick
 from .portfolio import Portfolio
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+LOG = getLogger(__name__)
+
+
+def default(obj):
+    if isinstance(obj, (CandleStick, Event, Portfolio)):
+        return obj.json()
+    elif isinstance(obj, EventType):
+        return obj.value
+    elif isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
 
 class StonksEncoder(JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, (CandleStick, Event, Portfolio)):
-            return obj.json()
-        elif isinstance(obj, EventType):
-            return obj.value
-        elif isinstance(obj, (date, datetime)):
-            return obj.isoformat()
-        # Let the base class default method raise the TypeError
-        return super().default(obj)
+        try:
+            return default(obj)
+        except TypeError:
+            # Let the base class default method raise the TypeError
+            return super().default(obj)
+
+
+class TextFrame(bytes):
+    """UTF-8 encoded JSON sent to WebSocket clients as a text message, plain bytes are binary protocol frames"""
+
+    __slots__ = ()
+
+
+class Codec(NamedTuple):
+    name: str
+    dumps: Callable[[Any], str]
+    # Straight to UTF-8, for frames written to sockets, pipes and gzip as they are
+    dumpb: Callable[[Any], bytes]
+    loads: Callable[[Union[str, bytes]], Any]
+
+
+def _json_dumps(obj: Any) -> str:
+    # Compact and not ASCII escaped, the same output as the other codecs
+    return dumps(obj, cls=StonksEncoder, separators=(",", ":"), ensure_ascii=False)
+
+
+CODECS: Dict[str, Codec] = {"json": Codec("json", _json_dumps, lambda obj: _json_dumps(obj).encode(), loads)}
+
+if orjson is not None:
+    # Enums, dates and datetimes are encoded natively, default() is only called for the project's own types. orjson
+    # encodes to UTF-8, frames are kept as those bytes all the way to the socket
+    CODECS["orjson"] = Codec(
+        "orjson",
+        lambda obj: orjson.dumps(obj, default=default).decode(),
+        lambda obj: orjson.dumps(obj, default=default),
+        orjson.loads,
+    )
+
+
+if msgspec is not None:
+    # Like orjson, with enums, dates and datetimes encoded natively and default() called for the project's own types
+    _msgspec_encoder = msgspec.json.Encoder(enc_hook=default)
+    CODECS["msgspec"] = Codec(
+        "msgspec",
+        lambda obj: _msgspec_encoder.encode(obj).decode(),
+        _msgspec_encoder.encode,
+        msgspec.json.decode,
+    )
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """The named codec, or the fastest one installed"""
+    if name is None:
+        return CODECS.get("orjson", CODECS.get("msgspec", CODECS["json"]))
+    if name not in CODECS:
+        LOG.warning("JSON codec %s is not available, falling back to the standard library", name)
+        return CODECS["json"]
+    return CODECS[name]
+
+
+codec = get_codec(c.JSON_CODEC)
+serialize = codec.dumps
+serialize_bytes = codec.dumpb
+deserialize = codec.loads
 
 
-serialize = partial(dumps, cls=StonksEncoder)
+def serialize_frame(obj: Any) -> TextFrame:
+    """Encode an event for WebSocket clients, once for all of them"""
+    return TextFrame(serialize_bytes(obj))
@@ -0,0 +1,173 @@
+"""Dashboard server"""
+
+from abc import ABC, abstractmethod
+from logging import getLogger
+from os.path import isdir, join
+from typing import Callable, Dict, Iterable, Optional
+from weakref import WeakSet
+
+from aiohttp import WSMsgType, web
+
+from . import config as c
+from .clients import Client, ClientOptions, Frame
+from .events import EventType
+from .serialize import deserialize
+from .snapshots import Snapshot
+
+LOG = getLogger(__name__)
+
+
+async def get_index(request):
+    return web.FileResponse(join(c.PUB_ROOT, "index.html"))
+
+
+def dashboard_app() -> web.Application:
+    """Application serving the dashboard build, portfolios add their WebSocket and snapshot routes"""
+    app = web.Application()
+    app.add_routes([web.get("/", get_index)])
+    if isdir(join(c.PUB_ROOT, "static")):
+        app.router.add_static("/static/", path=join(c.PUB_ROOT, "static"), name="static")
+    else:
+        LOG.warning("Dashboard build not found in %s, serving the WebSocket API only", c.PUB_ROOT)
+
+    return app
+
+
+class Dashboard(ABC):
+    """
+    Serves a portfolio to the dashboard, its snapshots and WebSocket clients. Where the events and snapshots come
+    from is up to subclasses, the portfolio in this process or the event stream of a primary process. Paths are
+    suffixes to the /ws and /snapshot routes, e.g. "/family" serves /ws/family.
+    """
+
+    def __init__(self, app: web.Application, paths: Iterable[str] = ("",)) -> None:
+        self.app = app
+        self.clients: WeakSet = WeakSet()
+        self.snapshots: Dict[EventType, Snapshot] = {}
+
+        for path in paths:
+            self.app.add_routes(
+                [
+                    web.get(f"/ws{path}", self.get_ws),
+                    web.get(f"/snapshot{path}/{{name}}", self.get_snapshot),
+                ]
+            )
+
+    async def get_snapshot(self, request):
+        """Portfolio or chart snapshot over plain HTTP, gzipped for clients accepting it and cacheable by ETag"""
+        try:
+            snapshot = self.snapshots[EventType(request.match_info["name"])]
+        except (KeyError, ValueError):
+            raise web.HTTPNotFound()
+
+        frame = snapshot.frame()
+        if frame is None:
+            raise web.HTTPServiceUnavailable(text="Snapshot not available yet")
+
+        headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if request.headers.get("If-None-Match") == snapshot.etag:
+            return web.Response(status=304, headers=headers)
+
+        body = frame
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            body = snapshot.gzipped()
+            headers["Content-Encoding"] = "gzip"
+
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+    async def get_ws(self, request):
+        try:
+            options = ClientOptions.from_query(request.query)
+        except ValueError as e:
+            LOG.warning("[WS] Rejecting client %s with invalid options: %s", request.remote, e)
+            raise web.HTTPBadRequest(text=f"Invalid options: {e}")
+
+        ws = web.WebSocketResponse(compress=options.compress)
+        await ws.prepare(request)
+        client = Client(ws, request.remote, options)
+        clients = self.clients
+        self.attach(client)
+
+        LOG.info("[WS] Client connected %s (connected: %d)", request.remote, len(clients))
+        LOG.debug("[WS] %s", client)
+        try:
+            self.welcome(client)
+
+            async for msg in ws:
+                LOG.debug("[WS] Received msg: %s", msg)
+
+                if msg.type == WSMsgType.TEXT:
+                    if msg.data == "close":
+                        await ws.close()
+                        LOG.info("[WS] Closed %s", ws)
+                    elif msg.data == "resync":
+                        LOG.debug("[WS] Client %s requested portfolio resync", request.remote)
+                        self.resync(client)
+                    elif msg.data.startswith("{"):
+                        self.handle_request(client, msg.data)
+                elif msg.type == WSMsgType.ERROR:
+                    LOG.error("[WS] Closed with unexpected error")
+                    LOG.exception(ws.exception())
+                elif msg.type in (WSMsgType.CLOSING, WSMsgType.CLOSED):
+                    await ws.close()
+                    LOG.info("[WS] Closed %s", ws)
+        finally:
+            # Also when the handler is cancelled or fails, so the client is never left registered
+            await self.detach(client)
+            LOG.info("[WS] Closed %s (connected: %d)", request.remote, len(clients))
+
+        return ws
+
+    def attach(self, client: Client):
+        self.clients.add(client)
+        client.start()
+
+    async def detach(self, client: Client):
+        self.clients.discard(client)
+        await client.stop()
+
+    def welcome(self, client: Client):
+        """Initial state sent to a connecting client"""
+        self.resync(client)
+        self.send_snapshot(client, EventType.CHART)
+
+    def resync(self, client: Client):
+        self.send_snapshot(client, EventType.PORTFOLIO)
+
+    def send_snapshot(self, client: Client, event_type: EventType):
+        frame = self.snapshots[event_type].frame()
+        if frame is not None:
+            client.send(frame)
+
+    def handle_request(self, client: Client, data: str):
+        try:
+            request = deserialize(data)
+        except ValueError:
+            LOG.warning("[WS] Ignoring malformed request from %s: %s", client.remote, data)
+            return
+
+        if request.get("type") == EventType.CHART.value:
+            self.send_chart(client, request)
+        else:
+            LOG.warning("[WS] Ignoring unknown request from %s: %s", client.remote, data)
+
+    @abstractmethod
+    def send_chart(self, client: Client, request: dict):
+        pass
+
+    def fan_out(self, event_type: EventType, encode: Callable[[bool], Frame], topic: Optional[str] = None):
+        """
+        Send an event to every client wanting it, encoded once per protocol and shared by all clients. The topic
+        keeps rate limited events of different instruments apart.
+        """
+        frames: Dict[bool, Frame] = {}
+        for client in self.clients:
+            if not client.options.wants(event_type):
+                continue
+            if client.binary not in frames:
+                frames[client.binary] = encode(client.binary)
+            client.send(frames[client.binary], event_type, topic)
+
+    async def close_clients(self):
+        for client in list(self.clients):
+            await client.stop()
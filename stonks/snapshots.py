@@ -0,0 +1,59 @@
+"""Cached state snapshots"""
+
+import gzip
+from logging import getLogger
+from time import time
+from typing import Any, Callable, Optional
+
+from . import config as c
+from .events import Event, EventType
+from .serialize import TextFrame, serialize_frame
+
+LOG = getLogger(__name__)
+
+# Versions start over on restart, the boot time keeps ETags from one run from matching the next
+BOOT = format(int(time()), "x")
+
+
+class Snapshot:
+    """
+    Pre-serialized event frame of some piece of state, shared by every client asking for it. The frame is only
+    rebuilt when the version of the underlying state has changed, and the gzip variant is compressed at most
+    once per version as well.
+    """
+
+    def __init__(self, event_type: EventType, data: Callable[[], Any], version: Callable[[], int]) -> None:
+        self.event_type = event_type
+        self.version: Optional[int] = None
+        self.builds = 0
+        self.hits = 0
+        self._data = data
+        self._version = version
+        self._frame: Optional[TextFrame] = None
+        self._gzipped: Optional[bytes] = None
+
+    def frame(self) -> TextFrame:
+        version = self._version()
+        if self._frame is None or version != self.version:
+            self._frame = serialize_frame(Event(self.event_type, self._data()).json())
+            self._gzipped = None
+            self.version = version
+            self.builds += 1
+            LOG.debug("[Snapshot] Rebuilt %s snapshot version %d", self.event_type.value, version)
+        else:
+            self.hits += 1
+
+        return self._frame
+
+    def gzipped(self) -> bytes:
+        frame = self.frame()
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(frame, c.SNAPSHOT_GZIP_LEVEL)
+        return self._gzipped
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.event_type.value}-{BOOT}-{self.version}"'
+
+    def __repr__(self) -> str:
+        return f"Snapshot<{self.event_type.value}>(version={self.version}, builds={self.builds}, hits={self.hits})"
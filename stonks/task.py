@@ -1,4 +1,4 @@
-"""Async, event emitting, self-restarting task"""
+"""Async, self-restarting task"""
 
 from abc import ABC, abstractmethod
 from asyncio import sleep
@@ -7,7 +7,6 @@ from logging import getLogger
 from typing import Optional
 
 from .config import TASK_RESTART_MIN_WAIT_TIME
-from .events import EventEmitter
 
 LOG = getLogger(__name__)
 
@@ -26,7 +25,7 @@ class TaskStats:
         }
 
 
-class Task(ABC, EventEmitter):
+class Task(ABC):
     def __init__(self, name: str, **kwargs):
         super().__init__(**kwargs)
         self.name: str = name
@@ -0,0 +1,266 @@
+"""Collector worker processes"""
+
+from argparse import ArgumentParser
+import asyncio
+from asyncio.subprocess import PIPE, Process
+from logging import DEBUG, basicConfig, getLogger
+from os.path import abspath, dirname
+from signal import SIGINT, SIGTERM, SIG_IGN, signal
+import sys
+from typing import Any, BinaryIO, Dict, List, Optional, Set, Tuple, Union
+
+from . import config as c
+from . import ipc
+from .collectors.base import close_session
+from .collectors.euronext import EuronextForex, EuronextFunds
+from .collectors.finansavisen import Finansavisen
+from .collectors.nordnet import NordNetFunds
+from .collectors.simulator import Simulator
+from .collectors.yahoo import YahooFinance
+from .marketdata import MarketData
+from .portfolio import ExchangeRates, Position
+from .routing import Collector, Routes
+from .serialize import deserialize, serialize_bytes
+from .task import Task
+
+LOG = getLogger(__name__)
+
+COLLECTORS = {
+    cls.__name__: cls for cls in (NordNetFunds, EuronextFunds, EuronextForex, YahooFinance, Finansavisen, Simulator)
+}
+
+# Workers are started with the package root as working directory, so the package is importable wherever we run
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+def position_config(p: Position) -> Dict[str, Any]:
+    return {**p.config(), "asset": p.asset.name}
+
+
+def load_position(position: Dict[str, Any]) -> Dict[str, Any]:
+    return {**position, "asset": c.Asset[position["asset"]]}
+
+
+class WorkerTask(Collector, Task):
+    """
+    Runs a collector in a worker process, so response decoding doesn't compete with the dashboard for the event
+    loop. The worker is sent the positions when it starts and every change to them after, and sends back batches
+    of price updates which are passed on to the market data here. Stats of the collector are forwarded, and a worker
+    exiting on its own is restarted like any other failing task.
+    """
+
+    def __init__(self, market: MarketData, collector: str) -> None:
+        super().__init__(name=collector)
+        self.market = market
+        self.collector = collector
+        self.process: Optional[Process] = None
+        self.tickers = market.routes.register(self)
+
+    def owns(self, position: Position) -> bool:
+        # The collector in the worker picks the positions it polls, every position change is passed on
+        return True
+
+    async def routes_changed(self, added: Set[str], removed: Set[str]):
+        for ticker in added:
+            await self.send(ipc.COMMAND, {"add": position_config(self.market.positions[ticker])})
+        for ticker in removed:
+            await self.send(ipc.COMMAND, {"remove": ticker})
+
+    async def send(self, frame_type: int, command: Union[Dict[str, Any], List[Dict[str, Any]]]):
+        if self.process is None or self.process.stdin.is_closing():
+            return
+
+        self.process.stdin.write(ipc.frame(frame_type, serialize_bytes(command)))
+        await self.process.stdin.drain()
+
+    async def run(self):
+        args = [self.collector, "--debug"] if getLogger().isEnabledFor(DEBUG) else [self.collector]
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", __name__, *args, stdin=PIPE, stdout=PIPE, cwd=ROOT
+        )
+        LOG.info("[%s] Started worker process %d", self.name, self.process.pid)
+
+        # Stats from the worker start over with every process, add them to what was counted before
+        base = (self.stats.messages, self.stats.errors, self.stats.restarts)
+        await self.send(ipc.POSITIONS, [position_config(p) for p in self.market.positions.values()])
+
+        try:
+            while True:
+                frame_type, payload = await ipc.read_frame(self.process.stdout)
+
+                if frame_type == ipc.UPDATES:
+                    pairs, initial = ipc.decode_updates(payload)
+                    await self.market.update(pairs, initial=initial)
+                elif frame_type == ipc.INDEX:
+                    await self.market.update_index(*ipc.decode_index(payload))
+                elif frame_type == ipc.STATS:
+                    messages, errors, restarts = ipc.decode_stats(payload)
+                    self.stats.messages = base[0] + messages
+                    self.stats.errors = base[1] + errors
+                    self.stats.restarts = base[2] + restarts
+                else:
+                    LOG.warning("[%s] Ignoring unknown frame type %d from worker", self.name, frame_type)
+        except asyncio.IncompleteReadError:
+            pass
+
+        code = await self.process.wait()
+        self.process = None
+        if code < 0 and self.restart:
+            # Killed by a signal, which may have been sent to every process of a service that is shutting down. Give
+            # the core the time to stop us, instead of spawning a worker it is about to stop again
+            LOG.warning("[%s] Worker process killed by signal %d", self.name, -code)
+            await asyncio.sleep(c.WORKER_STOP_TIMEOUT)
+        if self.restart:
+            raise RuntimeError(f"Worker process exited with code {code}")
+
+        LOG.info("[%s] Worker process exited with code %d", self.name, code)
+
+    async def stop(self):
+        LOG.info("[%s] Stopping...", self.name)
+        self.restart = False
+
+        # Closing stdin tells the worker to stop its collector and exit
+        process = self.process
+        if process is not None and process.returncode is None:
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), c.WORKER_STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                LOG.warning("[%s] Worker process %d did not exit, killing it", self.name, process.pid)
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    # Exited just as the wait timed out
+                    pass
+                # Reap it, so no zombie or unread pipe is left behind
+                await process.wait()
+
+        LOG.info("[%s] Stopped", self.name)
+
+
+class WorkerMarket:
+    """
+    Stands in for the market data in a worker process. Positions are kept for the collector to route and poll, price
+    updates are coalesced per ticker and written to the core in batches.
+    """
+
+    def __init__(self, positions: List[Dict[str, Any]], out: BinaryIO) -> None:
+        self.exchange_rates = ExchangeRates()
+        self.positions = {p["ticker"]: Position(**p, exchange_rates=self.exchange_rates) for p in positions}
+        self.routes = Routes(self.positions)
+        self.running = False
+        self._out = out
+        self._pending: Dict[str, float] = {}
+        self._stats: Optional[Tuple[int, int, int]] = None
+
+    async def update(self, pairs: Union[Tuple[str, float], List[Tuple[str, float]]], initial: bool = False):
+        if isinstance(pairs, tuple):
+            pairs = [pairs]
+
+        # Collectors like the simulator work from the latest prices
+        for ticker, market_price in pairs:
+            if ticker in self.positions:
+                self.positions[ticker].market_price = market_price
+            elif ticker in self.exchange_rates:
+                self.exchange_rates[ticker].market_price = market_price
+
+        if initial:
+            self.write(ipc.encode_updates(pairs, initial=True))
+        else:
+            self._pending.update(pairs)
+
+    async def update_index(self, ticker: str, name: str, last: float, change: float, change_7d: float):
+        self.write(ipc.encode_index(ticker, name, last, change, change_7d))
+
+    async def add_position(self, position: Dict[str, Any]):
+        p = self.positions[position["ticker"]] = Position(**position, exchange_rates=self.exchange_rates)
+        await self.routes.add(p)
+
+    async def remove_position(self, ticker: str):
+        if self.positions.pop(ticker, None) is not None:
+            self._pending.pop(ticker, None)
+            await self.routes.remove(ticker)
+
+    async def run(self, task: Task):
+        """Send batched updates, and the stats of the collector task whenever they change"""
+        self.running = True
+
+        while self.running:
+            await asyncio.sleep(c.WORKER_FLUSH_INTERVAL)
+            self.flush()
+
+            stats = (task.stats.messages, task.stats.errors, task.stats.restarts)
+            if stats != self._stats:
+                self.write(ipc.encode_stats(task.stats))
+                self._stats = stats
+
+    def flush(self):
+        if self._pending:
+            self.write(ipc.encode_updates(list(self._pending.items())))
+            self._pending = {}
+
+    def write(self, frame: bytes):
+        self._out.write(frame)
+        self._out.flush()
+
+    def stop(self):
+        self.running = False
+        self.flush()
+
+
+async def work(collector: str):
+    loop = asyncio.get_running_loop()
+    control = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(control), sys.stdin)
+
+    # Anything printed would corrupt the frames on stdout, the core passes on our stderr
+    out = sys.stdout.buffer
+    sys.stdout = sys.stderr
+
+    # Commands are framed like the updates going the other way, so the positions can be any size
+    _, payload = await ipc.read_frame(control)
+    market = WorkerMarket([load_position(p) for p in deserialize(payload)], out)
+    task: Task = COLLECTORS[collector](market)
+    tasks = [asyncio.create_task(task.start(), name=task.name), asyncio.create_task(market.run(task))]
+    LOG.info("[%s] Worker started with %d positions", task.name, len(market.positions))
+
+    # Runs until the core closes stdin, either to stop us or because it exited
+    while True:
+        try:
+            frame_type, payload = await ipc.read_frame(control)
+        except asyncio.IncompleteReadError:
+            break
+        if frame_type != ipc.COMMAND:
+            LOG.warning("[%s] Ignoring unexpected frame type %d from the core", task.name, frame_type)
+            continue
+
+        command = deserialize(payload)
+        if "add" in command:
+            await market.add_position(load_position(command["add"]))
+        elif "remove" in command:
+            await market.remove_position(command["remove"])
+
+    await task.stop()
+    market.stop()
+    await close_session()
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = ArgumentParser(description="Run a collector, reading positions from stdin and writing prices to stdout")
+    parser.add_argument("collector", choices=sorted(COLLECTORS), help="collector to run")
+    parser.add_argument("-d", "--debug", action="store_true", help="enable debug output")
+    args = parser.parse_args()
+
+    basicConfig(level=DEBUG if args.debug else c.LOG_LEVEL, format=c.LOG_FORMAT, datefmt=c.LOG_DATEFORMAT)
+    # Ctrl-C and a service manager stopping the service reach every process, the core decides when workers stop
+    signal(SIGINT, SIG_IGN)
+    signal(SIGTERM, SIG_IGN)
+
+    asyncio.run(work(args.collector))
+
+
+if __name__ == "__main__":
+    main()
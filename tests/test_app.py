@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+
+from stonks.app import PortfolioDashboard
+from stonks.bus import EventBus
+
+
+class PausingBus(EventBus):
+    """Bus pausing in the middle of unsubscribing, until released"""
+
+    def __init__(self, pause_at: str) -> None:
+        super().__init__()
+        self.pause_at = pause_at
+        self.paused = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def unsubscribe(self, pattern, cb):
+        if pattern == self.pause_at:
+            self.paused.set()
+            await self.release.wait()
+        await super().unsubscribe(pattern, cb)
+
+
+def dashboard(bus: EventBus) -> PortfolioDashboard:
+    # Only the subscription bookkeeping is under test, skip building the app and snapshots
+    dashboard = PortfolioDashboard.__new__(PortfolioDashboard)
+    dashboard.bus = bus
+    dashboard.portfolio = None
+    dashboard.clients = set()
+    dashboard.relays = set()
+    dashboard.listening = False
+    return dashboard
+
+
+class TestListen(unittest.IsolatedAsyncioTestCase):
+    def subscribed(self, d: PortfolioDashboard):
+        return {topic for topic in d.TOPICS if d.broadcast in d.bus._subscriptions.get(topic, {})}
+
+    async def test_unlisten_without_clients(self):
+        d = dashboard(EventBus())
+        d.listen()
+        self.assertEqual(self.subscribed(d), set(d.TOPICS))
+
+        await d.unlisten()
+        self.assertFalse(d.listening)
+        self.assertEqual(self.subscribed(d), set())
+
+    async def test_attach_while_unlistening(self):
+        d = dashboard(PausingBus(PortfolioDashboard.TOPICS[2]))
+        d.listen()
+
+        unlisten = asyncio.create_task(d.unlisten())
+        await d.bus.paused.wait()
+
+        # A client attaching while the first topics are already unsubscribed
+        d.listen()
+        d.clients.add(object())
+        d.bus.release.set()
+        await unlisten
+
+        self.assertTrue(d.listening)
+        self.assertEqual(self.subscribed(d), set(d.TOPICS))
+
+        await d.bus.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from stonks.bus import EventBus
+from stonks.events import Dispatch, EventType
+
+
+class Subscriber:
+    async def cb(self, event):
+        pass
+
+
+class TestSubscribe(unittest.IsolatedAsyncioTestCase):
+    async def test_idle_observer_is_shared_and_stopped(self):
+        bus = EventBus()
+        s = Subscriber()
+        for pattern in ("ticker.#", "portfolio.#", "chart.tick"):
+            bus.subscribe(pattern, s.cb, dispatch=Dispatch.QUEUE)
+
+        observers = {id(o): o for subscribers in bus._subscriptions.values() for o in subscribers.values()}
+        self.assertEqual(len(observers), 1)
+
+        observer = next(iter(observers.values()))
+        await bus.publish("chart.tick", EventType.CHART_TICK)
+        worker = observer._worker
+        self.assertIsNotNone(worker)
+
+        for pattern in ("ticker.#", "portfolio.#", "chart.tick"):
+            await bus.unsubscribe(pattern, s.cb)
+        self.assertTrue(worker.done())
+
+
+if __name__ == "__main__":
+    unittest.main()
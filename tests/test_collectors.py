@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+
+from stonks.collectors.euronext import EuronextFunds
+from stonks.config import Asset
+from stonks.db import Database
+from stonks.marketdata import MarketData
+from stonks.portfolio import Portfolio
+
+
+def fund(ticker, price=100):
+    return {
+        "name": ticker,
+        "ticker": ticker,
+        "volume": 1,
+        "price": price,
+        "cost": price,
+        "currency": "NOK",
+        "asset": Asset.FUND,
+    }
+
+
+class MockResponse:
+    def __init__(self, status, data=None, headers=None):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self, loads=None):
+        return self.data
+
+
+class MockSession:
+    """Serves a fund ranking with an ETag, and a 304 to requests revalidating it"""
+
+    def __init__(self, prices):
+        self.prices = prices
+        self.requests = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.requests.append(headers or {})
+        if (headers or {}).get("If-None-Match") == "v1":
+            return MockResponse(304)
+        rows = [{"key": t, "values": {"PRICE": p}} for t, p in self.prices.items()]
+        return MockResponse(200, {"rows": rows}, {"ETag": "v1"})
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.portfolio = Portfolio(Database(), [fund("DI_NOTEC_OSE")], ticks=False)
+        self.market = MarketData(self.portfolio.db, [self.portfolio])
+        self.collector = EuronextFunds(self.market)
+        self.collector._semaphore = asyncio.Semaphore(1)
+        self.collector.session = self.session = MockSession({"DI_NOTEC_OSE": 110, "KLP_OSE": 220})
+
+    async def asyncTearDown(self):
+        await self.portfolio.bus.stop()
+
+    async def collect(self):
+        # Like a collection cycle of HTTPClientTask.run
+        self.collector.fresh, self.collector.added = self.collector.added, set()
+        await self.collector.collect()
+
+    async def test_new_position_priced_from_cached_ranking(self):
+        await self.collect()
+        self.assertEqual(len(self.session.requests), 1)
+        self.assertEqual(self.market.positions["DI_NOTEC_OSE"].market_price, 110)
+
+        await self.portfolio.reload([fund("DI_NOTEC_OSE"), fund("KLP_OSE")])
+        self.assertEqual(self.collector.added, {"KLP_OSE"})
+        await self.collect()
+
+        self.assertEqual(len(self.session.requests), 1)
+        self.assertEqual(self.market.positions["KLP_OSE"].market_price, 220)
+
+    async def test_revalidated_after_ttl(self):
+        await self.collect()
+        for cached in self.collector.cache.values():
+            cached.expires = 0
+
+        await self.collect()
+        self.assertEqual(len(self.session.requests), 2)
+        self.assertEqual(self.session.requests[1]["If-None-Match"], "v1")
+
+
+if __name__ == "__main__":
+    unittest.main()
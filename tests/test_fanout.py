@@ -0,0 +1,30 @@
+from argparse import Namespace
+import unittest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from stonks.fanout import FanOut
+
+
+class TestFanOut(unittest.IsolatedAsyncioTestCase):
+    async def connect(self, portfolio, path):
+        # No primary listens on the socket, the upstream keeps retrying in the background
+        fanout = FanOut(Namespace(port=0, socket="/nonexistent/stonks.sock", portfolio=portfolio))
+        async with TestClient(TestServer(fanout.app)) as client:
+            resp = await client.get(path)
+            if resp.status != 404:
+                ws = await client.ws_connect(path)
+                await ws.close()
+            return resp.status
+
+    async def test_serves_named_portfolio(self):
+        self.assertNotEqual(await self.connect("alice", "/ws/alice"), 404)
+        self.assertNotEqual(await self.connect("alice", "/ws"), 404)
+
+    async def test_default_portfolio(self):
+        self.assertNotEqual(await self.connect(None, "/ws"), 404)
+        self.assertEqual(await self.connect(None, "/ws/alice"), 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+from stonks import ipc
+
+
+class TestStrings(unittest.TestCase):
+    def test_round_trip(self):
+        data = ipc.pack_str("Oslo Børs (OSEBX)")
+        self.assertEqual(ipc.unpack_str(data + b"rest", 0), ("Oslo Børs (OSEBX)", len(data)))
+
+    def test_truncated_on_character_boundary(self):
+        # 254 bytes, followed by a character taking two
+        s = "x" * 254 + "ø" * 10
+        data = ipc.pack_str(s)
+        self.assertLessEqual(len(data), 256)
+        self.assertEqual(ipc.unpack_str(data, 0), ("x" * 254, 255))
+
+    def test_index_frame(self):
+        payload = ipc.encode_index("OSEBX_OSE", "Ø" * 200, 1234.5, 0.5, -1.25)[ipc.header.size :]
+        ticker, name, *values = ipc.decode_index(payload)
+        self.assertEqual((ticker, name, values), ("OSEBX_OSE", "Ø" * 127, [1234.5, 0.5, -1.25]))
+
+
+if __name__ == "__main__":
+    unittest.main()
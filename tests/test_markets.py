@@ -0,0 +1,40 @@
+from datetime import datetime
+import unittest
+
+from stonks import config as c
+from stonks.markets import EXCHANGES, poll_interval
+
+OSE = EXCHANGES["OSE"]
+
+
+def oslo(*args) -> datetime:
+    return datetime(*args, tzinfo=OSE.tz)
+
+
+class TestPollInterval(unittest.TestCase):
+    def test_regular_interval_while_open(self):
+        self.assertEqual(poll_interval([OSE], 60, oslo(2026, 10, 14, 12, 0)), 60)
+
+    def test_speedup_near_close(self):
+        self.assertEqual(poll_interval([OSE], 60, oslo(2026, 10, 14, 16, 20)), 60 / c.MARKET_EDGE_SPEEDUP)
+
+    def test_grace_after_close(self):
+        # Delayed feeds send the closing price after 16:25
+        self.assertEqual(poll_interval([OSE], 60, oslo(2026, 10, 14, 16, 26)), 60)
+        self.assertEqual(poll_interval([OSE], 60, oslo(2026, 10, 14, 17, 24)), 60)
+
+    def test_backs_off_after_grace(self):
+        self.assertEqual(poll_interval([OSE], 60, oslo(2026, 10, 14, 17, 30)), c.MARKET_CLOSED_MAX_INTERVAL)
+
+    def test_wakes_up_for_open(self):
+        self.assertEqual(poll_interval([OSE], 60, oslo(2026, 10, 15, 8, 50)), 600)
+
+    def test_no_grace_after_weekend(self):
+        self.assertEqual(poll_interval([OSE], 60, oslo(2026, 10, 17, 12, 0)), c.MARKET_CLOSED_MAX_INTERVAL)
+
+    def test_unknown_exchange_polled_at_fixed_interval(self):
+        self.assertEqual(poll_interval([OSE, None], 60, oslo(2026, 10, 17, 12, 0)), 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
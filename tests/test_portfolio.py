@@ -0,0 +1,57 @@
+import unittest
+
+from stonks.config import Asset
+from stonks.db import Database
+from stonks.events import Dispatch
+from stonks.portfolio import Portfolio
+
+
+def positions():
+    return [
+        {
+            "name": "MOWI",
+            "ticker": "MOWI_OSE",
+            "volume": 10,
+            "price": 180,
+            "cost": 2000,
+            "currency": "NOK",
+            "asset": Asset.EQUITY,
+        },
+        {
+            "name": "DNB Teknologi A",
+            "ticker": "DI_NOTEC_OSE",
+            "volume": 1,
+            "price": 1000,
+            "cost": 1000,
+            "currency": "NOK",
+            "asset": Asset.FUND,
+        },
+    ]
+
+
+class TestDelta(unittest.IsolatedAsyncioTestCase):
+    async def test_composition_after_updates_nobody_listened_to(self):
+        portfolio = Portfolio(Database(), positions(), ticks=False)
+        deltas = []
+
+        async def on_delta(e):
+            deltas.append(e.data)
+
+        before = portfolio.aggregates.composition()
+        # Nobody is subscribed, the change is not sent anywhere
+        await portfolio._process([("DI_NOTEC_OSE", 1500)])
+        self.assertEqual(portfolio.json()["composition"], {"Equity": 54.5, "Mutual Fund": 45.5})
+
+        # A client subscribing now starts from the snapshot above, and the next delta goes back to the start
+        portfolio.bus.subscribe("portfolio.delta", on_delta, dispatch=Dispatch.SEQUENTIAL)
+        await portfolio._process([("DI_NOTEC_OSE", 1000)])
+
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(deltas[0]["composition"], before)
+        self.assertEqual(before, {"Equity": 64.3, "Mutual Fund": 35.7})
+
+        await portfolio.bus.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
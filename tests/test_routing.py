@@ -0,0 +1,96 @@
+import unittest
+
+from stonks.collectors.finansavisen import Finansavisen
+from stonks.config import Asset
+from stonks.db import Database
+from stonks.marketdata import MarketData
+from stonks.portfolio import Portfolio
+from stonks.routing import Collector
+
+
+def position(ticker, asset=Asset.EQUITY, price=100):
+    return {
+        "name": ticker,
+        "ticker": ticker,
+        "volume": 10,
+        "price": price,
+        "cost": 10 * price,
+        "currency": "NOK",
+        "asset": asset,
+    }
+
+
+class Funds(Collector):
+    name = "Funds"
+
+    def __init__(self):
+        self.changes = []
+
+    def owns(self, p):
+        return p.asset == Asset.FUND
+
+    async def routes_changed(self, added, removed):
+        self.changes.append((added, removed))
+
+
+class MockWebSocket:
+    closed = False
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_str(self, data):
+        self.sent.append(data)
+
+
+class TestReload(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = Database()
+        self.portfolios = [
+            Portfolio(self.db, [position("MOWI_OSE"), position("DI_NOTEC_OSE", Asset.FUND)], ticks=False),
+            Portfolio(self.db, [position("MOWI_OSE")], name="Other", history_table="history_other", ticks=False),
+        ]
+        self.market = MarketData(self.db, self.portfolios)
+        self.funds = Funds()
+        self.tickers = self.market.routes.register(self.funds)
+
+    async def asyncTearDown(self):
+        for p in self.portfolios:
+            await p.bus.stop()
+
+    async def test_routes_follow_reloaded_positions(self):
+        portfolio = self.portfolios[0]
+        await portfolio.reload([position("MOWI_OSE"), position("KLP_OSE", Asset.FUND)])
+
+        self.assertEqual(set(portfolio.positions), {"MOWI_OSE", "KLP_OSE"})
+        self.assertEqual(self.tickers, {"KLP_OSE"})
+        self.assertEqual(self.funds.changes, [(set(), {"DI_NOTEC_OSE"}), ({"KLP_OSE"}, set())])
+        self.assertEqual(self.market.routes.owners("KLP_OSE"), {"Funds"})
+        self.assertEqual(self.market.routes.owners("DI_NOTEC_OSE"), set())
+
+    async def test_instruments_held_elsewhere_stay_routed(self):
+        await self.portfolios[0].reload([position("DI_NOTEC_OSE", Asset.FUND)])
+
+        self.assertIn("MOWI_OSE", self.market)
+        await self.portfolios[1].reload([])
+        self.assertNotIn("MOWI_OSE", self.market)
+
+    async def test_finansavisen_resubscribes(self):
+        finansavisen = Finansavisen(self.market)
+        finansavisen.firehose = False
+        finansavisen.ws = MockWebSocket()
+        await finansavisen.subscribe_tickers(finansavisen.tickers)
+        self.assertEqual(set(finansavisen.channels.values()), {"MOWI_OSE"})
+        mowi = next(iter(finansavisen.channels))
+
+        await self.portfolios[0].reload([position("NHY_OSE")])
+        await self.portfolios[1].reload([])
+
+        self.assertEqual(finansavisen.tickers, {"NHY_OSE"})
+        self.assertEqual(set(finansavisen.channels.values()), {"NHY_OSE"})
+        self.assertIn(f"unsubscribe?channel={mowi}", finansavisen.ws.sent)
+        self.assertTrue(any(s.startswith("subscribe?itemSector=NHY.OSE&") for s in finansavisen.ws.sent))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+from datetime import datetime
+import unittest
+
+from stonks import config as c
+from stonks.events import Event, EventType
+from stonks.serialize import CODECS
+
+OBJECTS = [
+    Event(EventType.CHART, [1]),
+    {"event": Event(EventType.TICKER, {"ticker": "MOWI_OSE", "last": 201.5}, "ticker.MOWI_OSE")},
+    {"type": EventType.INDEX, "name": "Oslo Børs (OSEBX)", "time": datetime(2026, 1, 2, 3, 4, 5, tzinfo=c.TZ)},
+]
+
+
+class TestCodecs(unittest.TestCase):
+    def test_codecs_encode_alike(self):
+        for obj in OBJECTS:
+            expected = CODECS["json"].dumpb(obj)
+            for name, codec in CODECS.items():
+                with self.subTest(codec=name, obj=obj):
+                    self.assertEqual(codec.dumpb(obj), expected)
+                    self.assertEqual(codec.dumps(obj), expected.decode())
+
+    def test_event_encoded_as_object(self):
+        for name, codec in CODECS.items():
+            with self.subTest(codec=name):
+                self.assertEqual(codec.dumpb(Event(EventType.CHART, [1])), b'{"type":"chart","data":[1]}')
+
+
+if __name__ == "__main__":
+    unittest.main()